@@ -0,0 +1,323 @@
+""" COG-UK sequence metadata.
+
+    The full metadata file has a row for every sequenced genome. Parsing it is slow, so
+    it's converted into a typed, columnar snapshot on disk, which is only rebuilt when
+    the upstream file changes. The snapshot is stored as memory-mapped numpy arrays:
+    categorical columns as integer codes, sample dates as day numbers and mutation
+    flags as a bit-packed matrix with a row per sequence.
+
+    The genomics graphs work from a count cube: the number of sequences per sample date,
+    nation, sequencing region and lineage, which is stored with the snapshot.
+
+    Each day's update mostly adds new sequences and revises a few recent ones, so the
+    snapshot keeps a hash of every row. When the file changes, only rows with a new
+    hash are processed, and the cube is updated by the difference.
+"""
+import os
+import json
+import shutil
+import logging
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from download import fetch, CACHE_DIR
+from cog_sites import extract_sequencing_region
+
+URL = "https://cog-uk.s3.climb.ac.uk/phylogenetics/latest/cog_metadata.csv.gz"
+
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, "cog_metadata")
+
+Mutation = namedtuple("Mutation", ["label", "values", "plot"], defaults=[True])
+
+# Mutation columns in the metadata file, with the values which indicate that a sequence
+# has the mutation, and whether it's shown on the mutation prevalence graph. Changing
+# this causes the snapshot to be rebuilt, which flags all mutations in a single pass.
+MUTATIONS = {
+    "d614g": Mutation("S D614G", ["G"]),
+    "a222v": Mutation("S A222V", ["V"]),
+    "n501y": Mutation("S N501Y", ["Y"]),
+    "p681h": Mutation("S P681H", ["H"]),
+    "e484k": Mutation("S E484[K|Q]", ["K", "Q"]),
+    "del_21765_6": Mutation("S Δ69-70", ["del"]),
+    "q27stop": Mutation("ORF8 Q27stop", ["*"]),
+    "t1001i": Mutation("ORF1ab T1001I", ["I"]),
+    "n439k": Mutation("S N439K", ["K"], plot=False),
+    "p323l": Mutation("ORF1ab P323L", ["L"], plot=False),
+    "y453f": Mutation("S Y453F", ["F"], plot=False),
+}
+
+# Columns read from the metadata file.
+COLUMNS = ["sequence_name", "sample_date", "adm1", "lineage"] + list(MUTATIONS)
+
+# The snapshot also stores the region each sequence was sequenced in, which is derived
+# from its name.
+SNAPSHOT_COLUMNS = COLUMNS + ["region"]
+
+CATEGORICAL_COLUMNS = ["sequence_name", "adm1", "region", "lineage"]
+
+# Bumped when the snapshot layout changes, so that old snapshots are rebuilt.
+SNAPSHOT_VERSION = 3
+
+# Counts are kept per day, nation, region and lineage.
+COUNT_KEYS = ["sample_date", "adm1", "region", "lineage"]
+
+# Day number used for a missing sample date.
+MISSING_DAY = np.iinfo(np.int32).min
+
+log = logging.getLogger(__name__)
+
+
+def read_cog_metadata(path, chunksize=None):
+    """ Read the columns of the metadata file which the graphs use, returning a
+        DataFrame, or an iterator of DataFrames if `chunksize` is given.
+    """
+    return pd.read_csv(
+        path,
+        usecols=COLUMNS,
+        parse_dates=["sample_date"],
+        dtype={mutation: "category" for mutation in MUTATIONS},
+        chunksize=chunksize,
+    )
+
+
+def flag_mutations(data):
+    for mutation, config in MUTATIONS.items():
+        data[mutation] = data[mutation].isin(config.values)
+    return data
+
+
+def _mutation_config():
+    return {mutation: config.values for mutation, config in MUTATIONS.items()}
+
+
+def _source_id(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _read_snapshot_meta():
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _hash_rows(chunk):
+    """ Hash each row of a chunk as read by `read_cog_metadata`, so that rows which
+        are new or have changed since the last snapshot can be found.
+    """
+    return pd.util.hash_pandas_object(chunk, index=False).values
+
+
+def _isin_sorted(values, sorted_values):
+    """ Whether each of `values` is in the sorted array `sorted_values`. np.isin
+        would sort the stored hashes again for every chunk.
+    """
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    position = np.searchsorted(sorted_values, values)
+    return sorted_values[np.minimum(position, len(sorted_values) - 1)] == values
+
+
+def _encode(chunk, hashes):
+    """ Convert a chunk of rows, with mutations flagged, into snapshot arrays. """
+    arrays = {column: pd.Categorical(chunk[column]) for column in CATEGORICAL_COLUMNS}
+    day = chunk["sample_date"].values.astype("datetime64[D]")
+    arrays["sample_date"] = np.where(
+        np.isnat(day), MISSING_DAY, day.astype(np.int64)
+    ).astype(np.int32)
+    arrays["mutations"] = np.packbits(chunk[list(MUTATIONS)].values, axis=1)
+    arrays["row_hash"] = hashes
+    return arrays
+
+
+def _read_categories(column):
+    with open(os.path.join(SNAPSHOT_DIR, f"{column}.categories")) as f:
+        categories = f.read()
+    return pd.Index(categories.split("\n") if categories else [])
+
+
+def _load_arrays(rows):
+    """ The arrays of the current snapshot, for the rows selected by `rows`. """
+    arrays = {}
+    for column in CATEGORICAL_COLUMNS:
+        codes = np.load(os.path.join(SNAPSHOT_DIR, f"{column}.npy"), mmap_mode="r")
+        arrays[column] = pd.Categorical.from_codes(
+            codes[rows], _read_categories(column)
+        )
+    for name in ["sample_date", "mutations", "row_hash"]:
+        path = os.path.join(SNAPSHOT_DIR, f"{name}.npy")
+        arrays[name] = np.load(path, mmap_mode="r")[rows]
+    return arrays
+
+
+def _plain_counts(counts):
+    # Use plain values rather than categoricals in the index, so that grouping on the
+    # counts only produces groups which actually occur.
+    counts = counts.astype(int).reset_index()
+    counts = counts.astype({key: object for key in COUNT_KEYS if key != "sample_date"})
+    return counts.set_index(COUNT_KEYS)
+
+
+def _add_counts(counts, delta):
+    return delta if counts is None else counts.add(delta, fill_value=0)
+
+
+def build_snapshot(path, previous=None, chunksize=500000):
+    """ Convert the metadata file at `path` into a columnar snapshot, along with the
+        count cube built from it.
+
+        If `previous` is the meta of an existing snapshot, only rows which are new or
+        have changed since it was built are processed. The counts of those rows are
+        added to the stored cube, and the counts of rows which have since changed or
+        gone are subtracted, so only the cells for the affected dates are touched.
+    """
+    if previous is None:
+        log.info("Building COG-UK metadata snapshot")
+        old_hashes = np.array([], dtype=np.uint64)
+    else:
+        old_hashes = np.load(os.path.join(SNAPSHOT_DIR, "row_hash.npy"))
+    sorted_hashes = np.sort(old_hashes)
+
+    hashes = []
+    added = []
+    added_counts = None
+    for chunk in read_cog_metadata(path, chunksize=chunksize):
+        chunk_hashes = _hash_rows(chunk)
+        hashes.append(chunk_hashes)
+        is_new = ~_isin_sorted(chunk_hashes, sorted_hashes)
+        if not is_new.any():
+            continue
+
+        chunk = flag_mutations(chunk[is_new].copy())
+        chunk["region"] = extract_sequencing_region(chunk["sequence_name"])
+        added.append(_encode(chunk, chunk_hashes[is_new]))
+        added_counts = _add_counts(added_counts, count_genomes(chunk))
+
+    # Rows in the previous snapshot which are no longer in the file, either because
+    # they've changed or have been withdrawn.
+    keep = _isin_sorted(old_hashes, np.sort(np.concatenate(hashes)))
+    removed_counts = None
+    columns = [column for column in SNAPSHOT_COLUMNS if column != "sequence_name"]
+    for start in range(0, len(old_hashes), chunksize):
+        removed = ~keep[start : start + chunksize]
+        if removed.any():
+            rows = load_snapshot(previous, columns, start, start + chunksize)[removed]
+            removed_counts = _add_counts(removed_counts, count_genomes(rows))
+
+    counts = None
+    parts = added
+    if previous is not None:
+        counts = pd.read_pickle(os.path.join(SNAPSHOT_DIR, "counts.pkl"))
+        parts = [_load_arrays(keep)] + added
+    for delta, sign in [(added_counts, 1), (removed_counts, -1)]:
+        if delta is not None:
+            counts = _add_counts(counts, sign * _plain_counts(delta))
+            dates = delta.index.get_level_values("sample_date")
+            log.info(
+                "%s %d COG-UK sequences sampled between %s and %s",
+                "Added" if sign > 0 else "Removed",
+                delta["count"].sum(),
+                dates.min(),
+                dates.max(),
+            )
+    counts = counts[counts["count"] != 0].astype(int)
+
+    tmp_dir = SNAPSHOT_DIR + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "source": _source_id(path),
+        "length": 0,
+        "mutations": _mutation_config(),
+    }
+    for column in CATEGORICAL_COLUMNS:
+        values = union_categoricals([part[column] for part in parts])
+        np.save(os.path.join(tmp_dir, f"{column}.npy"), values.codes)
+        with open(os.path.join(tmp_dir, f"{column}.categories"), "w") as f:
+            f.write("\n".join(values.categories))
+        meta["length"] = len(values)
+
+    for name in ["sample_date", "mutations", "row_hash"]:
+        np.save(
+            os.path.join(tmp_dir, f"{name}.npy"),
+            np.concatenate([part[name] for part in parts]),
+        )
+    counts.to_pickle(os.path.join(tmp_dir, "counts.pkl"))
+
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+    os.replace(tmp_dir, SNAPSHOT_DIR)
+    return meta
+
+
+def update_snapshot(chunksize=500000):
+    """ Fetch the metadata file, updating the snapshot if it has changed. """
+    path = fetch(URL)
+    meta = _read_snapshot_meta()
+    if meta is not None and (
+        meta.get("version") != SNAPSHOT_VERSION
+        or meta["mutations"] != _mutation_config()
+    ):
+        # Stored in a different form, so start again.
+        meta = None
+    if meta is None or meta["source"] != _source_id(path):
+        meta = build_snapshot(path, meta, chunksize)
+    return meta
+
+
+def load_snapshot(meta, columns=SNAPSHOT_COLUMNS, start=0, stop=None):
+    """ Load rows `start` to `stop` of the snapshot described by `meta` as a
+        DataFrame.
+    """
+    stop = meta["length"] if stop is None else min(stop, meta["length"])
+    data = {}
+    mutations = [column for column in columns if column in MUTATIONS]
+    if mutations:
+        packed = np.load(os.path.join(SNAPSHOT_DIR, "mutations.npy"), mmap_mode="r")
+        flags = np.unpackbits(packed[start:stop], axis=1, count=len(MUTATIONS))
+        for mutation in mutations:
+            data[mutation] = flags[:, list(MUTATIONS).index(mutation)].astype(bool)
+
+    for column in columns:
+        path = os.path.join(SNAPSHOT_DIR, f"{column}.npy")
+        if column in CATEGORICAL_COLUMNS:
+            codes = np.load(path, mmap_mode="r")[start:stop]
+            data[column] = pd.Categorical.from_codes(codes, _read_categories(column))
+        elif column == "sample_date":
+            days = np.load(path, mmap_mode="r")[start:stop]
+            dates = days.astype("datetime64[D]").astype("datetime64[ns]")
+            dates[days == MISSING_DAY] = np.datetime64("NaT")
+            data[column] = dates
+    return pd.DataFrame(data, columns=columns)
+
+
+def fetch_cog_metadata():
+    return load_snapshot(update_snapshot())
+
+
+def count_genomes(data):
+    """ Aggregate sequence rows into the number of sequences, and the number with each
+        mutation, per sample date, nation (adm1), region and lineage.
+
+        The result is indexed by those keys and only has rows for combinations which
+        occur, so it's a sparse cube: most lineages are only seen on a few days.
+    """
+    data = data.assign(count=1)
+    return data.groupby(COUNT_KEYS, dropna=False, observed=True)[
+        ["count"] + list(MUTATIONS)
+    ].sum()
+
+
+def fetch_cog_counts():
+    """ Fetch the count cube, as returned by `count_genomes`, for every sequence in the
+        metadata file.
+    """
+    update_snapshot()
+    return pd.read_pickle(os.path.join(SNAPSHOT_DIR, "counts.pkl"))
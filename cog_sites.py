@@ -0,0 +1,143 @@
+""" Sequencing sites of COG-UK genomes, and the regions they're in, derived from
+    sequence names.
+"""
+import numpy as np
+import pandas as pd
+
+sources_map = {
+    "PORT": "Portsmouth",
+    "LOND": "London",  # UCL/Imperial
+    "NORT": "Newcastle",  # University of Northumbria
+    "EXET": "Exeter",  # University of Exeter
+    "NORW": "Norwich",  # Quadram Institute Bioscience
+    "MILK": "Milton Keynes",  # Lighthouse Lab Milton Keynes (Wellcome Sanger Institute)
+    "ALDP": "Alderley Park",  # Lighthouse
+    "QEUH": "Glasgow",  # Glasgow
+    "BIRM": "Birmingham",  # University of Birmingham
+    "BHRT": "London",  # Barking, Havering, Redbridge trust
+    "PHEC": "London",  # PHE Colindale
+    "CAMC": "Cambridge",  # Cambridge lighthouse lab,
+    "WSFT": "Chichester",  # Western Sussex Foundation Trust
+    "LIVE": "Liverpool",  # Liverpool Clinical Laboratories
+    "NOTT": "Nottingham",  # DeepSeq Nottingham
+    "LCST": "Nottingham",  # Seems to be nottingham but what does LCST stand for?
+    "SHEF": "Sheffield",  # University of Sheffield
+    "CAMB": "Cambridge",  # University of Cambridge
+    "BRIS": "Bristol",
+    "EKHU": "Ashford",
+    "HECH": "Hereford",
+    "KGHT": "Kettering",  # Kettering general hospital trust (presumed)
+    "OXON": "Oxford",
+    "LEED": "Leeds",
+    "TBSD": "Torbay",  # The Department of Microbiology, Torbay and South Devon NHS Foundation Trust
+    "GSTT": "London",  # Guys and St Thomas',
+    "PHWC": "Cardiff",  # PHW Cardiff (presumably)
+    "GCVR": "Glasgow",  # MRC-University of Glasgow Centre for Virus Research
+    "EDB": "Edinburgh",
+    "CVR": "Glasgow",
+    "QEU": "Glasgow",
+    "NIRE": "Northern Ireland",
+    "TFCI": "London",  # The Francis Crick Institute
+    "CWAR": "Warwick",  # Coventry and Warwick something something
+    "MTUN": "Maidstone",  # Maidstone and Tunbridge Wells
+    "PRIN": "Harlow",  # Princess Alexandra Hospital
+}
+
+sources_region_map = {
+    "Alderley Park": "North West",
+    "Ashford": "South East",
+    "Birmingham": "Midlands",
+    "Bristol": "South West",
+    "Cambridge": "East of England",
+    "Cardiff": "Wales",
+    "Chichester": "South East",
+    "Edinburgh": "Scotland",
+    "Exeter": "South West",
+    "Glasgow": "Scotland",
+    "Harlow": "East of England",
+    "Hereford": "Midlands",
+    "Kettering": "Midlands",
+    "Leeds": "North East and Yorkshire",
+    "Liverpool": "North West",
+    "London": "London",
+    "Maidstone": "South East",
+    "Milton Keynes": "East of England",
+    "Newcastle": "North East and Yorkshire",
+    "Northern Ireland": "Northern Ireland",
+    "Norwich": "East of England",
+    "Nottingham": "Midlands",
+    "Oxford": "South East",
+    "Portsmouth": "South East",
+    "Sheffield": "North East and Yorkshire",
+    "Torbay": "South West",
+    "Warwick": "Midlands",
+}
+
+
+def sequencing_sites(seq_names):
+    """ Find the (country, site code) pair of each name in a Series of sequence
+        names, returning each name's integer pair code (-1 if the name is malformed)
+        and a DataFrame of the distinct pairs.
+
+        Names look like "England/MILK-9E05B3/2020". The site code is the part of the
+        sample ID before the "-", or its first three characters if there's no "-".
+    """
+    parts = seq_names.astype(object).str.split("/", n=2, expand=True)
+    # Names without a "/" have no sample ID, and aren't given a site.
+    parts = parts.reindex(columns=[0, 1]).astype(object)
+    country, sample = parts[0], parts[1]
+    site = sample.str.split("-", n=1).str[0].where(
+        sample.str.contains("-", regex=False), sample.str[:3]
+    )
+
+    codes, uniques = pd.factorize(country + "/" + site)
+    sites = pd.DataFrame(
+        [pair.split("/", 1) for pair in uniques], columns=["country", "site"]
+    )
+    return codes, sites
+
+
+def _lookup(codes, values, index):
+    """ Categorical Series of `values` (one per distinct pair) for each pair code. """
+    value_codes, categories = pd.factorize(pd.Series(values, dtype=object))
+    value_codes = np.append(value_codes, -1)  # so that pair code -1 maps to NaN
+    return pd.Series(
+        pd.Categorical.from_codes(value_codes[codes], categories), index=index
+    )
+
+
+def _site_source(site):
+    if not isinstance(site, str):
+        return None
+    return sources_map.get(site, site)
+
+
+def _site_region(country, site):
+    if not isinstance(country, str):
+        return None
+    if country != "England":
+        return country.replace("_", " ")
+    region = sources_region_map.get(_site_source(site), country)
+    if region in ["Scotland", "Wales", "Northern Ireland"]:
+        # This is an English genome sequenced outside England
+        return country
+    return region
+
+
+def extract_sequencing_source(seq_names):
+    """ Sequencing site (city) of each sequence in a Series of sequence names. """
+    codes, sites = sequencing_sites(seq_names)
+    sources = [_site_source(site) for site in sites["site"]]
+    return _lookup(codes, sources, seq_names.index)
+
+
+def extract_sequencing_region(seq_names):
+    """ Region of each sequence in a Series of sequence names, based on where it
+        was sequenced.
+    """
+    codes, sites = sequencing_sites(seq_names)
+    regions = [
+        _site_region(country, site)
+        for country, site in zip(sites["country"], sites["site"])
+    ]
+    return _lookup(codes, regions, seq_names.index)
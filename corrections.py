@@ -1,6 +1,7 @@
 import numpy as np
 import coviddata.uk
 from datetime import date, timedelta
+from geography import Geography
 
 
 def correct_scottish_data(scot_data):
@@ -27,21 +28,6 @@ def correct_scottish_data(scot_data):
 
 
 def cases_by_nhs_region(data, la_region_mapping):
-    nhs_regions = []
-    for a in data["gss_code"]:
-        name = str(a.data)
-        if name[0] == "E":
-            nhs_regions.append(la_region_mapping["nhs_name"][name])
-        elif name[0] == "W":
-            nhs_regions.append("Wales")
-        elif name[0] == "S":
-            nhs_regions.append("Scotland")
-        elif name[0] == "N":
-            nhs_regions.append("Northern Ireland")
-
-    res = data.assign_coords({"gss_code": nhs_regions}).rename({'gss_code': 'location'})
-    return (
-        res.ffill("date").groupby("location")
-        .sum()
-        .drop_sel(location=["Wales", "Scotland", "Northern Ireland"])
-    )
+    """ Cases in each NHS England region, summed from local authorities. """
+    nhs_regions = Geography(la_region_mapping).rollup(data.ffill("date"))
+    return nhs_regions.drop_sel(location=["Wales", "Scotland", "Northern Ireland"])
@@ -0,0 +1,82 @@
+""" Named series derived from cumulative cases, each computed at most once per dataset.
+
+    Derived series are stored as variables of the dataset they're derived from, so
+    they're sliced along with it, and are carried with it when it's passed to another
+    task of the build. Deriving the series which pages use in the task which builds a
+    dataset means that every page reuses them rather than computing its own.
+
+    Hits and misses are counted in each process, and reported by the build.
+"""
+from collections import Counter
+
+
+def _daily(data, var):
+    daily = data[var].ffill("date").fillna(0).diff("date")
+    # Filter out numbers below 0 which happen when cases are un-reported.
+    return daily.where(daily > 0, 0)
+
+
+def _weekly(daily):
+    weekly = daily.rolling(date=7).sum()
+    return weekly.where(weekly > 0, 0)
+
+
+def _rolling(days, daily="daily_cases"):
+    def derivation(data):
+        return series(data, daily).rolling(date=days, center=True).mean()
+
+    return derivation
+
+
+def _week_ratio(data):
+    weekly = series(data, "weekly_cases")
+    return weekly / weekly.shift(date=7)
+
+
+# Derivations of each named series from a dataset with cumulative "cases" and, per
+# head of population, "cases_norm". Rolling averages are centred, and weekly totals
+# are of the 7 days up to each date. Net daily cases keep downward revisions, as the
+# national and regional figures always have.
+DERIVATIONS = {
+    "daily_cases": lambda data: _daily(data, "cases"),
+    "net_daily_cases": lambda data: data["cases"].diff("date"),
+    "cases_rolling_7": _rolling(7),
+    "net_cases_rolling_7": _rolling(7, "net_daily_cases"),
+    "cases_rolling_14": _rolling(14),
+    "weekly_cases": lambda data: _weekly(series(data, "daily_cases")),
+    "weekly_cases_per_100k": lambda data: _weekly(_daily(data, "cases_norm")) * 100000,
+    "week_ratio": _week_ratio,
+}
+
+_counts = Counter()
+
+
+def series(data, name):
+    """ The derived series `name` of the dataset `data`, which is computed and stored
+        in `data` unless it's already there.
+    """
+    if name in data:
+        _counts["hits"] += 1
+        return data[name]
+    _counts["misses"] += 1
+    data[name] = DERIVATIONS[name](data)
+    return data[name]
+
+
+def derive(data, names):
+    """ Compute the derived series `names` of `data` ahead of use, returning `data`. """
+    for name in names:
+        series(data, name)
+    return data
+
+
+def take_counts():
+    """ Hits and misses in this process since they were last taken. """
+    counts = dict(_counts)
+    _counts.clear()
+    return counts
+
+
+def add_counts(counts):
+    """ Add hits and misses taken in another process. """
+    _counts.update(counts)
@@ -0,0 +1,183 @@
+""" On-disk cache for remote input files.
+
+    Each file is stored alongside the ETag/Last-Modified validators it was served with,
+    and is revalidated with a conditional GET on the next fetch, so unchanged files are
+    not downloaded again.
+
+    Downloads are streamed to a partial file in chunks. If a download is interrupted it
+    is resumed with a Range request, either immediately or on the next fetch.
+"""
+import os
+import json
+import fcntl
+import logging
+import hashlib
+import requests
+from urllib.parse import urlparse
+
+CACHE_DIR = os.environ.get("DOWNLOAD_CACHE_DIR", "./cache")
+
+CHUNK_SIZE = 1024 * 1024
+ATTEMPTS = 5
+
+log = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    pass
+
+
+def cache_path(url):
+    """ Local path of the cached copy of `url`. The original file name is kept as a
+        suffix so that readers which sniff the extension (e.g. for gzip) still work.
+    """
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    name = os.path.basename(urlparse(url).path) or "index"
+    return os.path.join(CACHE_DIR, f"{digest}-{name}")
+
+
+def _read_meta(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(path, meta):
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+def _validators(res):
+    return {
+        "etag": res.headers.get("ETag"),
+        "last_modified": res.headers.get("Last-Modified"),
+    }
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _download(url, headers, part_path, timeout):
+    """ Stream `url` into `part_path`, resuming from the end of any existing partial
+        file. Returns the response, or None if the server responded 304.
+    """
+    part_meta_path = part_path + ".meta.json"
+    part_meta = _read_meta(part_meta_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    # Content-Length and Range offsets are of the encoded body, so the body is asked
+    # for unencoded. If a server encodes it anyway, the download can't be resumed.
+    headers = dict(headers, **{"Accept-Encoding": "identity"})
+    validator = part_meta.get("etag") or part_meta.get("last_modified")
+    if offset and validator and not part_meta.get("encoded"):
+        # If-Range makes the server send the whole file if it has changed since the
+        # partial download started.
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+    else:
+        offset = 0
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as res:
+        if res.status_code == 304:
+            return None
+        if res.status_code == 416:
+            # The partial file is longer than the file on the server, so start again.
+            _remove(part_path, part_meta_path)
+            raise DownloadError(f"{url}: can't resume download from byte {offset}")
+        res.raise_for_status()
+
+        if res.status_code == 206:
+            log.info("Resuming download of %s from byte %d", url, offset)
+            expected = int(res.headers["Content-Range"].split("/")[-1])
+            mode = "ab"
+        else:
+            encoded = res.headers.get("Content-Encoding", "identity") != "identity"
+            expected = res.headers.get("Content-Length")
+            expected = int(expected) if expected and not encoded else None
+            _write_meta(part_meta_path, dict(_validators(res), encoded=encoded))
+            mode = "wb"
+
+        with open(part_path, mode) as f:
+            for chunk in res.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+    size = os.path.getsize(part_path)
+    if expected is not None and size != expected:
+        # A short file is resumed on the next attempt, but a long one can't be.
+        if size > expected:
+            _remove(part_path, part_meta_path)
+        raise DownloadError(f"{url}: expected {expected} bytes, got {size}")
+    return res
+
+
+def fetch(url, timeout=300, verify=None):
+    """ Fetch `url` through the download cache, returning the path to a local copy.
+
+        If a cached copy exists, its validators are sent with the request and the
+        cached file is reused if the server responds with 304 Not Modified.
+
+        `verify`, if supplied, is called with the path of a newly-downloaded file and
+        should raise if the file is corrupt, in which case it is discarded.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(url)
+    # Tasks of the build which run at the same time may fetch the same URL, and would
+    # share its partial file, so fetches of a URL hold a lock. Later fetches then
+    # revalidate the copy which the first one downloaded.
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _fetch(url, path, timeout, verify)
+
+
+def _fetch(url, path, timeout, verify):
+    part_path = path + ".part"
+    meta = _read_meta(path + ".meta.json") if os.path.exists(path) else {}
+
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            res = _download(url, headers, part_path, timeout)
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            DownloadError,
+        ) as e:
+            # The partial file is kept, so the next attempt carries on from where
+            # this one stopped.
+            if attempt == ATTEMPTS:
+                raise
+            log.warning("Download of %s interrupted (%s), retrying", url, e)
+
+    if res is None:
+        log.info("%s not modified, using cached copy", url)
+        return path
+
+    if verify is not None:
+        try:
+            verify(part_path)
+        except Exception as e:
+            _remove(part_path, part_path + ".meta.json")
+            raise DownloadError(f"{url}: downloaded file failed verification: {e}")
+
+    meta = _read_meta(part_path + ".meta.json")
+    meta["url"] = url
+    os.replace(part_path, path)
+    _write_meta(path + ".meta.json", meta)
+    _remove(part_path + ".meta.json")
+    log.info("Downloaded %s (%d bytes)", url, os.path.getsize(path))
+    return path
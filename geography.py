@@ -0,0 +1,110 @@
+""" Lookups from GSS codes to the names, nations and NHS England regions of areas.
+
+    Lookups take an array of codes and resolve them all at once. The lookup tables
+    in data/ are loaded once, on import. Mapping local authorities to NHS regions
+    also needs the la_region table, which is fetched during the build, so those
+    lookups are methods of `Geography`.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+NATIONS = {"E": "England", "W": "Wales", "S": "Scotland", "N": "Northern Ireland"}
+
+LAD_NAMES = pd.read_csv("data/lads.csv", encoding="utf-8-sig").set_index("LAD19CD")[
+    "LAD19NM"
+]
+
+CCG_REGIONS = (
+    pd.read_csv("data/ccg_region.csv", encoding="utf-8-sig")
+    .drop_duplicates("CCG20CD")
+    .set_index("CCG20CD")["NHSER20NM"]
+)
+
+
+def _lookup(table, gss_codes):
+    """ Values of `table` for each of `gss_codes`, with None where it has none. """
+    values = table.reindex(gss_codes).values.astype(object)
+    values[pd.isnull(values)] = None
+    return values
+
+
+def nation(gss_codes):
+    """ Nation of each area, from the first letter of its code. """
+    return _lookup(pd.Series(NATIONS), pd.Index(gss_codes, dtype=object).str[0])
+
+
+def name(gss_codes):
+    """ Name of each local authority, or its code if it's newer than the lookup. """
+    names = _lookup(LAD_NAMES, gss_codes)
+    return np.where(pd.isnull(names), gss_codes, names)
+
+
+def ccg_region(gss_codes):
+    """ NHS England region of each CCG. """
+    return _lookup(CCG_REGIONS, gss_codes)
+
+
+def grouping(labels):
+    """ Group areas by `labels`, returning the sorted names of the groups and a
+        (group, area) matrix of which areas are in each. Areas with no label are
+        left out of every group.
+    """
+    codes, groups = pd.factorize(pd.Series(labels, dtype=object), sort=True)
+    matrix = np.zeros((len(groups), len(codes)))
+    present = np.flatnonzero(codes >= 0)
+    matrix[codes[present], present] = 1
+    return np.asarray(groups), matrix
+
+
+def rollup(data, groups, matrix, dim="gss_code", group_dim="location"):
+    """ Sum the variables of the dataset `data` over the areas along `dim` in each
+        group, with a matrix product. Missing values count as zero.
+    """
+    summed = {}
+    for key, var in data.data_vars.items():
+        if dim not in var.dims:
+            summed[key] = var
+            continue
+        dims = [d for d in var.dims if d != dim]
+        values = np.tensordot(
+            matrix, np.nan_to_num(var.transpose(dim, *dims).values), axes=1
+        )
+        summed[key] = xr.DataArray(
+            values,
+            dims=[group_dim] + dims,
+            coords={d: var[d].values for d in dims if d in var.coords},
+        )
+    return xr.Dataset(summed).assign_coords({group_dim: groups})
+
+
+class Geography:
+    """ Lookups which use `la_region`, the mapping of local authorities to NHS
+        England regions.
+    """
+
+    def __init__(self, la_region):
+        self.la_regions = la_region["nhs_name"]
+
+    def nhs_region(self, gss_codes):
+        """ NHS England region of each local authority or CCG, or the nation of
+            areas outside England.
+        """
+        regions = _lookup(self.la_regions, gss_codes)
+        missing = pd.isnull(regions)
+        regions[missing] = ccg_region(np.asarray(gss_codes)[missing])
+
+        nations = nation(gss_codes)
+        outside = pd.isnull(regions) & (nations != "England")
+        regions[outside] = nations[outside]
+        return regions
+
+    def grouping(self, gss_codes, by="nhs_region"):
+        """ The groups and grouping matrix of `gss_codes` by nation or NHS region. """
+        lookup = nation if by == "nation" else getattr(self, by)
+        return grouping(lookup(gss_codes))
+
+    def rollup(self, data, by="nhs_region", dim="gss_code", group_dim="location"):
+        """ Sum `data` by the nation or NHS region of the areas along `dim`. """
+        groups, matrix = self.grouping(data[dim].values, by)
+        return rollup(data, groups, matrix, dim, group_dim)
@@ -8,15 +8,19 @@ from bokeh.models import (
     NumeralTickFormatter,
     DatetimeTickFormatter,
     ColumnDataSource,
+    CDSView,
+    IndexFilter,
     DatetimeAxis,
     Span,
     Label,
 )
-from bokeh.transform import linear_cmap
+from bokeh.transform import linear_cmap, log_cmap
+from bokeh.core.properties import value
 from bokeh.models.tools import HoverTool
 from bokeh.palettes import Dark2, RdYlBu
 
 from util import dict_to_xr
+from derived import series
 from .common import (
     figure,
     country_hover_tool,
@@ -103,7 +107,7 @@ def uk_cases_graph(uk_cases):
         label = layer
         fig.line(
             x=uk_cases_national["date"].values,
-            y=uk_cases_national.sel(location=layer)["cases_rolling"].values,
+            y=uk_cases_national.sel(location=layer)["net_cases_rolling_7"].values,
             line_width=2,
             line_color=NATION_COLOURS[layer],
             legend_label=label,
@@ -239,7 +243,7 @@ def regional_cases(regions):
         color = next(colours)
         fig.line(
             x=s["date"].values,
-            y=s["cases_rolling"].values / nhs_region_pops[loc] * 100000 * 7,
+            y=s["net_cases_rolling_7"].values / nhs_region_pops[loc] * 100000 * 7,
             legend_label=loc,
             name=loc,
             color=color,
@@ -456,11 +460,7 @@ def case_ratio_heatmap(by_age):
 
 
 def rising_cases(eng_by_gss):
-    cases_rolling_change = (
-        (eng_by_gss["cases"].diff("date").rolling(date=7).mean())
-        .dropna("date")
-        .diff("date")
-    )
+    cases_rolling_change = series(eng_by_gss, "weekly_cases").diff("date")
 
     rising = (
         cases_rolling_change.where(cases_rolling_change > 0)
@@ -586,3 +586,182 @@ def case_ratio(cases_data, location="England"):
     # fig.yaxis.axis_label = "⭠  Halving    Doubling  ⭢"
 
     return fig
+
+
+def case_ratio_grid(eng_by_gss, names, days=90, step=2, columns=10):
+    """ Small multiples of the weekly case ratio in every local authority, labelled
+        with `names`, on a log scale clipped to between halving and doubling, plotted
+        every `step` days.
+
+        All panels are drawn from a single ColumnDataSource. Each area's series is laid
+        out in its panel and the series are placed end to end, each followed by a row
+        which breaks the line and holds the panel's position and details. The
+        per-panel glyphs only draw those rows.
+    """
+    ratio = series(eng_by_gss, "week_ratio").transpose("gss_code", "date")
+    # Drop the provisional days, which would show a spurious fall.
+    ratio = ratio.isel(date=slice(-(days + PROVISIONAL_DAYS), -PROVISIONAL_DAYS))
+    # Sample back from the latest day, so that it's always included.
+    ratio = ratio.values[:, ::-step][:, ::-1]
+
+    order = np.argsort(names)
+    labels = np.asarray(names)[order]
+    ratio = ratio[order]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_ratio = np.clip(np.log2(ratio), -1, 1)
+
+    count, points = ratio.shape
+    rows = -(-count // columns)
+    panel_x = np.arange(count) % columns + 0.5
+    panel_y = -(np.arange(count) // columns).astype(float)
+
+    def end_to_end(values, panel_values=np.nan):
+        return np.concatenate(
+            [values, np.broadcast_to(panel_values, (count, 1))], axis=1
+        ).ravel()
+
+    def panels(values):
+        return end_to_end(np.full((count, points), np.nan), values[:, np.newaxis])
+
+    x = panel_x[:, np.newaxis] + np.linspace(-0.45, 0.45, points)
+    y = panel_y[:, np.newaxis] + log_ratio * 0.3
+    ds = ColumnDataSource(
+        {
+            "x": end_to_end(x).astype(np.float32),
+            "y": end_to_end(y).astype(np.float32),
+            "panel_x": panels(panel_x).astype(np.float32),
+            "panel_y": panels(panel_y).astype(np.float32),
+            "label_y": panels(panel_y + 0.46).astype(np.float32),
+            "ratio": panels(ratio[:, -1]).astype(np.float32),
+            "name": end_to_end(np.full((count, points), ""), labels[:, np.newaxis]),
+        }
+    )
+    panel_rows = list(range(points, count * (points + 1), points + 1))
+    view = CDSView(source=ds, filters=[IndexFilter(panel_rows)])
+
+    fig = bokeh_figure(
+        width=1200,
+        height=rows * 70 + 40,
+        x_range=(0, columns),
+        y_range=(-rows + 0.5, 0.5),
+        title=f"Weekly change in cases by local authority (last {days} days)",
+        sizing_mode="scale_width",
+        tools="",
+        toolbar_location=None,
+    )
+    backgrounds = fig.rect(
+        x="panel_x",
+        y="panel_y",
+        width=0.96,
+        height=0.96,
+        source=ds,
+        view=view,
+        fill_color=log_cmap("ratio", palette=RdYlBu[11], low=0.5, high=2),
+        fill_alpha=0.5,
+        line_color=None,
+    )
+    # No change, drawn as a zero-height rectangle.
+    fig.rect(
+        x="panel_x",
+        y="panel_y",
+        width=0.9,
+        height=0,
+        source=ds,
+        view=view,
+        fill_color=None,
+        line_color="#999999",
+        line_dash="dotted",
+    )
+    fig.text(
+        x="panel_x",
+        y="label_y",
+        text="name",
+        source=ds,
+        view=view,
+        text_font=value("Noto Sans"),
+        text_font_size="9px",
+        text_align="center",
+        text_baseline="top",
+        text_color="#333333",
+    )
+    fig.line(x="x", y="y", source=ds, line_width=1.5, line_color="#333333")
+
+    fig.add_tools(
+        HoverTool(
+            renderers=[backgrounds],
+            tooltips=[("Area", "@name"), ("Ratio to previous week", "@ratio{0.00}")],
+            toggleable=False,
+        )
+    )
+    fig.axis.visible = False
+    fig.grid.grid_line_color = None
+    return fig
+
+
+def la_cases_graph(data, name):
+    """ Daily cases, and their 7-day average, in a single local authority. """
+    cases = series(data, "daily_cases").dropna("date")
+    ds = ColumnDataSource(
+        {
+            "date": cases["date"].values,
+            "cases": cases.values,
+            "cases_rolling": series(data, "cases_rolling_7")
+            .sel(date=cases["date"])
+            .values,
+        }
+    )
+
+    fig = figure(title=f"New cases: {name}", interventions=False)
+    fig.add_tools(
+        HoverTool(
+            tooltips=[
+                ("Date", "@date{%d %b}"),
+                ("Cases", "@cases{0,0}"),
+                ("Rolling average", "@cases_rolling{0,0.0}"),
+            ],
+            formatters={"@date": "datetime"},
+            toggleable=False,
+        )
+    )
+    fig.vbar(
+        x="date",
+        top="cases",
+        source=ds,
+        width=8640 * 10e3 * 0.7,
+        legend_label="Cases",
+        line_width=0,
+        fill_color=BAR_COLOUR,
+    )
+    fig.line(
+        x="date",
+        y="cases_rolling",
+        source=ds,
+        line_width=2,
+        line_color=LINE_COLOUR[0],
+        legend_label="Rolling average",
+    )
+
+    fig.legend.location = "top_left"
+    fig.yaxis.formatter = NumeralTickFormatter(format="0,0")
+    add_provisional(fig, start_date=max_date(data) - timedelta(days=PROVISIONAL_DAYS))
+    return fig
+
+
+def la_positivity_graph(positivity, name):
+    """ Test positivity in a single local authority. """
+    fig = figure(title=f"Test positivity: {name}", interventions=False)
+    fig.add_tools(
+        HoverTool(
+            tooltips=[("Date", "$x{%d %b}"), ("Positivity", "$y{0.0}%")],
+            formatters={"$x": "datetime"},
+            toggleable=False,
+        )
+    )
+    fig.line(
+        x=positivity["date"].values,
+        y=positivity.values,
+        line_width=2,
+        line_color=LINE_COLOUR[0],
+    )
+    fig.yaxis.axis_label = "Positive tests (%)"
+    return fig
@@ -9,23 +9,12 @@ from bokeh.palettes import YlOrRd, RdYlBu
 from .common import figure
 
 
-def app_keys(data, by="export"):
+def app_keys(counts, by="export"):
+    """ Plot exposure key counts, as returned by NHSAppData.exposure_counts(by). """
     if by == "export":
         title = "Exposure keys by date of publication"
-        counts = data.groupby(data.export_date.dt.date).size()
     elif by == "interval":
         title = "Exposure keys by date of broadcast and risk level"
-        counts = (
-            pd.DataFrame(
-                data.groupby(
-                    [data.interval_start.dt.date, data.transmission_risk_level]
-                ).size()
-            )
-            .reset_index()
-            .set_index("interval_start")
-            .pivot(columns="transmission_risk_level")
-        )
-        counts.columns = [str(i[1]) for i in counts.columns.to_flat_index()]
     fig = figure(
         title=title,
         x_range=(
@@ -54,14 +43,8 @@ def app_keys(data, by="export"):
     return fig
 
 
-def risky_venues(risky_venues):
-    counts = (
-        risky_venues.groupby(
-            [risky_venues.export_date.dt.date, risky_venues.message_type]
-        )
-        .size()
-        .unstack()
-    ).fillna(0)
+def risky_venues(counts):
+    """ Plot risky venue counts, as returned by NHSAppData.risky_venue_counts(). """
     colors = ["#718dbf", "#e84d60"]
     labels = ["Inform", "Book test"]
     fig = figure(
@@ -1,122 +1,31 @@
-import requests
 import pandas as pd
 import numpy as np
 from datetime import date, timedelta
 from itertools import cycle
-from bokeh.models import NumeralTickFormatter, HoverTool
+from bokeh.models import NumeralTickFormatter, HoverTool, Span
+from bokeh.plotting import figure as bokeh_figure
 from bokeh.palettes import Set2, Category10, Greys
 from .common import figure, add_provisional
+from pango import lineage_index, PrefixTrie
+from cog_metadata import MUTATIONS
 
 PROVISIONAL_DAYS = 30
 
-sources_map = {
-    "PORT": "Portsmouth",
-    "LOND": "London",  # UCL/Imperial
-    "NORT": "Newcastle",  # University of Northumbria
-    "EXET": "Exeter",  # University of Exeter
-    "NORW": "Norwich",  # Quadram Institute Bioscience
-    "MILK": "Milton Keynes",  # Lighthouse Lab Milton Keynes (Wellcome Sanger Institute)
-    "ALDP": "Alderley Park",  # Lighthouse
-    "QEUH": "Glasgow",  # Glasgow
-    "BIRM": "Birmingham",  # University of Birmingham
-    "BHRT": "London",  # Barking, Havering, Redbridge trust
-    "PHEC": "London",  # PHE Colindale
-    "CAMC": "Cambridge",  # Cambridge lighthouse lab,
-    "WSFT": "Chichester",  # Western Sussex Foundation Trust
-    "LIVE": "Liverpool",  # Liverpool Clinical Laboratories
-    "NOTT": "Nottingham",  # DeepSeq Nottingham
-    "LCST": "Nottingham",  # Seems to be nottingham but what does LCST stand for?
-    "SHEF": "Sheffield",  # University of Sheffield
-    "CAMB": "Cambridge",  # University of Cambridge
-    "BRIS": "Bristol",
-    "EKHU": "Ashford",
-    "HECH": "Hereford",
-    "KGHT": "Kettering",  # Kettering general hospital trust (presumed)
-    "OXON": "Oxford",
-    "LEED": "Leeds",
-    "TBSD": "Torbay",  # The Department of Microbiology, Torbay and South Devon NHS Foundation Trust
-    "GSTT": "London",  # Guys and St Thomas',
-    "PHWC": "Cardiff",  # PHW Cardiff (presumably)
-    "GCVR": "Glasgow",  # MRC-University of Glasgow Centre for Virus Research
-    "EDB": "Edinburgh",
-    "CVR": "Glasgow",
-    "QEU": "Glasgow",
-    "NIRE": "Northern Ireland",
-    "TFCI": "London",  # The Francis Crick Institute
-    "CWAR": "Warwick",  # Coventry and Warwick something something
-    "MTUN": "Maidstone",  # Maidstone and Tunbridge Wells
-    "PRIN": "Harlow",  # Princess Alexandra Hospital
+NATION_CODES = {
+    "UK-ENG": "England",
+    "UK-SCT": "Scotland",
+    "UK-NIR": "Northern Ireland",
+    "UK-WLS": "Wales",
 }
 
-sources_region_map = {
-    "Alderley Park": "North West",
-    "Ashford": "South East",
-    "Birmingham": "Midlands",
-    "Bristol": "South West",
-    "Cambridge": "East of England",
-    "Cardiff": "Wales",
-    "Chichester": "South East",
-    "Edinburgh": "Scotland",
-    "Exeter": "South West",
-    "Glasgow": "Scotland",
-    "Harlow": "East of England",
-    "Hereford": "Midlands",
-    "Kettering": "Midlands",
-    "Leeds": "North East and Yorkshire",
-    "Liverpool": "North West",
-    "London": "London",
-    "Maidstone": "South East",
-    "Milton Keynes": "East of England",
-    "Newcastle": "North East and Yorkshire",
-    "Northern Ireland": "Northern Ireland",
-    "Norwich": "East of England",
-    "Nottingham": "Midlands",
-    "Oxford": "South East",
-    "Portsmouth": "South East",
-    "Sheffield": "North East and Yorkshire",
-    "Torbay": "South West",
-    "Warwick": "Midlands",
-}
-
-
-def fetch_cog_metadata():
-    data = pd.read_csv(
-        "https://cog-uk.s3.climb.ac.uk/phylogenetics/latest/cog_metadata.csv.gz",
-        parse_dates=["sample_date"],
-    )
-    data["d614g"] = data["d614g"] == "G"
-    data["n439k"] = data["n439k"] == "K"
-    data["p323l"] = data["p323l"] == "L"
-    data["a222v"] = data["a222v"] == "V"
-    data["y453f"] = data["y453f"] == "F"
-    data["n501y"] = data["n501y"] == "Y"
-    data["t1001i"] = data["t1001i"] == "I"
-    data["p681h"] = data["p681h"] == "H"
-    data["q27stop"] = data["q27stop"] == "*"
-    data["e484k"] = data["e484k"].isin(["K", "Q"])
-    data["del_21765_6"] = data["del_21765_6"] == "del"
-    return data
-
-
-def extract_sequencing_source(seq_name):
-    parts = seq_name.split("/")
-    if "-" not in parts[1]:
-        source = parts[1][:3]
-    else:
-        source = parts[1].split("-")[0]
-    return sources_map.get(source, source)
-
+# Region of English sequences whose sequencing site isn't known.
+UNKNOWN_REGION = "England"
 
-def extract_sequencing_region(seq_name):
-    parts = seq_name.split("/")
-    if parts[0] != "England":
-        return parts[0].replace("_", " ")
-    city = extract_sequencing_source(seq_name)
-    region = sources_region_map.get(city, parts[0])
-    if region in ["Scotland", "Wales", "Northern Ireland"]:
-        # This is an English genome sequenced outside England
-        return parts[0]
-    return region
+# Growth rates are fitted over this many days up to the latest sample date, for
+# lineages with at least GROWTH_MIN_SEQUENCES sequences in that time, and at least as
+# many in the rest of their parent lineage.
+GROWTH_WINDOW_DAYS = 42
+GROWTH_MIN_SEQUENCES = 100
 
 
 def prevalence_hover_tool():
@@ -131,26 +40,16 @@ def prevalence_hover_tool():
     )
 
 
-def genomes_by_nation(data):
+def genomes_by_nation(counts):
     fig = figure(title="Virus genomes sequenced by nation", interventions=False)
-    by_country = data.set_index("adm1")
     by_country = (
-        pd.DataFrame(
-            {
-                "England": by_country.loc["UK-ENG"]
-                .groupby("sample_date")["sequence_name"]
-                .count(),
-                "Scotland": by_country.loc["UK-SCT"]
-                .groupby("sample_date")["sequence_name"]
-                .count(),
-                "Northern Ireland": by_country.loc["UK-NIR"]
-                .groupby("sample_date")["sequence_name"]
-                .count(),
-                "Wales": by_country.loc["UK-WLS"]
-                .groupby("sample_date")["sequence_name"]
-                .count(),
-            }
-        )
+        counts["count"]
+        .groupby(["sample_date", "adm1"])
+        .sum()
+        .unstack()
+        .reindex(columns=list(NATION_CODES))
+        .rename(columns=NATION_CODES)
+        .rename_axis(columns=None)
         .fillna(0)
         .rolling(7, center=True)
         .mean()
@@ -172,36 +71,29 @@ def genomes_by_nation(data):
     return fig
 
 
-def mutation_prevalence(data):
+def mutation_prevalence(counts):
     fig = figure(title="UK mutation prevalence", interventions=True, y_axis_type="log")
     fig.y_range.start = 0.005
     fig.y_range.end = 1
     fig.add_tools(prevalence_hover_tool())
 
     mutations = {
-        "S D614G": "d614g",
-        "S A222V": "a222v",
-        "S N501Y": "n501y",
-        "S P681H": "p681h",
-        "S E484[K|Q]": "e484k",
-        "S Δ69-70": "del_21765_6",
-        "ORF8 Q27stop": "q27stop",
-        "ORF1ab T1001I": "t1001i",
+        config.label: mutation
+        for mutation, config in MUTATIONS.items()
+        if config.plot
     }
-    count = data.groupby("sample_date")["sequence_name"].count()
+    # Sum the count and every mutation column per day in one reduction.
+    daily = counts[["count"] + list(mutations.values())].groupby("sample_date").sum()
 
     summary = (
-        pd.DataFrame(
-            {
-                name: data.groupby("sample_date")[mutation].sum() / count
-                for name, mutation in mutations.items()
-            }
-        )
+        daily[list(mutations.values())]
+        .div(daily["count"], axis=0)
+        .set_axis(list(mutations), axis=1)
         .rolling(7, center=True)
         .mean()
     )
 
-    colours = cycle(Set2[len(mutations)])
+    colours = cycle(Set2[8])
 
     for name in mutations.keys():
         fig.line(
@@ -220,22 +112,19 @@ def mutation_prevalence(data):
     return fig
 
 
-def variant_prevalence_by_region(data, lineage, title):
-    data["location"] = data["sequence_name"].map(extract_sequencing_region)
-    count = data.groupby(["sample_date", "location"])["sequence_name"].count()
-
-    prevalence = pd.DataFrame(
-        {
-            "prevalence": data[data["lineage"] == lineage]
-            .groupby(["sample_date", "location"])["sequence_name"]
-            .count()
-            / count
-        }
+def variant_prevalence_by_region(counts, lineage, title):
+    counts = counts["count"]
+    count = counts.groupby(["sample_date", "region"]).sum()
+    lineage_count = (
+        counts[counts.index.get_level_values("lineage") == lineage]
+        .groupby(["sample_date", "region"])
+        .sum()
     )
 
-    prevalence = prevalence.fillna(0).unstack().rolling(7, center=True).mean()
-    prevalence.columns = prevalence.columns.get_level_values(1)
-    prevalence.drop(columns=["England"], inplace=True)
+    prevalence = (lineage_count / count).fillna(0).unstack()
+    prevalence = prevalence.rolling(7, center=True).mean().rename_axis(columns=None)
+    # Sequences from English sites which aren't in sources_region_map.
+    prevalence = prevalence.drop(columns=[UNKNOWN_REGION], errors="ignore")
 
     colours = cycle(Category10[10])
 
@@ -263,97 +152,84 @@ def variant_prevalence_by_region(data, lineage, title):
     return fig
 
 
-parent_lineages = requests.get(
-    "https://raw.githubusercontent.com/cov-lineages/pango-designation/master/pango_designation/alias_key.json"
-).json()
+def lineage_matrix(counts):
+    """Build a matrix of sequence counts by lineage (rows) and sample date (columns),
+    with a column for every day, from counts as returned by cog_metadata.count_genomes.
+    Sequences without a lineage are left out.
+    """
+    matrix = (
+        counts["count"]
+        .groupby(["lineage", "sample_date"])
+        .sum()
+        .unstack(fill_value=0)
+    )
+    dates = pd.date_range(
+        matrix.columns.min(), matrix.columns.max(), name="sample_date"
+    )
+    return matrix.reindex(columns=dates, fill_value=0)
 
-# Further info on the lineage naming rules here:
-# https://virological.org/t/pango-lineage-nomenclature-provisional-rules-for-naming-recombinant-lineages/657
 
+def collapse_lineages(matrix, threshold=0.15, always_interesting=[]):
+    """Work out which lineages in a lineage/date count matrix should be merged into
+    their parents, and return a mapping of each lineage to the lineage it ends up in.
 
-def summarise_lineages(data, threshold=0.15, always_interesting=[]):
-    """Summarise a COG-UK metadata dataframe, merging each lineage with its
-    parent lineage unless it has an average prevalence of more than `threshold` during
-    any 7-day window.
+    A lineage is merged unless it has an average prevalence of more than `threshold`
+    during any 7-day window. Merges are applied by adding rows of the matrix together,
+    and repeated until nothing changes.
     """
-    data = data[
-        ~data["lineage"].isnull()
-    ].copy()  # Filter out missing lineages to start
-    count = data.groupby("sample_date").count()["sequence_name"].rolling(7).mean()
-
+    count = matrix.sum().rolling(7).mean()
     # Don't use days with fewer than 300 samples to calculate prevalence
-    count = count[count > 300]
+    count = count.where(count > 300)
 
+    mapping = {lineage: lineage for lineage in matrix.index}
     while True:
-        lineage_prevalence = (
-            pd.DataFrame(
-                {
-                    "sample_date": data["sample_date"],
-                    "lineage": data["lineage"],
-                    "count": 1,
-                }
-            )
-            .set_index(["lineage", "sample_date"])
-            .sort_index()
-            .groupby(level=[0, 1])
-            .agg("sum")
-            .rolling(7)
-            .mean()
-        )
-
-        lineage_prevalence["prevalence"] = lineage_prevalence["count"] / count
-        max_lineages = lineage_prevalence.groupby("lineage").max()
+        prevalence = matrix.T.rolling(7).mean().div(count, axis=0)
+        max_prevalence = prevalence.max()
 
         interesting_lineages = set(
-            max_lineages[max_lineages["prevalence"] > threshold].index
+            max_prevalence[max_prevalence > threshold].index
         ) | set(always_interesting)
-        try:
-            interesting_lineages.remove("")
-        except KeyError:
-            pass
-
-        filtered_lineage = []
-        summarised_count = 0
-        for lineage in data["lineage"]:
-            if lineage in interesting_lineages:
-                filtered_lineage.append(lineage)
-                continue
-
-            summarised_lineage = summarise_lineage(lineage)
+        interesting_lineages.discard("")
+
+        index = lineage_index()
+        merges = {}
+        for lineage in matrix.index:
+            if lineage not in interesting_lineages:
+                parent = index.parent(lineage)
+                if parent != lineage:
+                    merges[lineage] = parent
+
+        if not merges:
+            return mapping
+
+        matrix = matrix.groupby(matrix.index.map(lambda l: merges.get(l, l))).sum()
+        mapping = {
+            lineage: merges.get(current, current)
+            for lineage, current in mapping.items()
+        }
 
-            if summarised_lineage != lineage:
-                summarised_count += 1
-            filtered_lineage.append(summarised_lineage)
 
-        data["lineage"] = filtered_lineage
+def summarise_lineages(counts, threshold=0.15, always_interesting=[], mapping=None):
+    """Summarise sequence counts (as returned by cog_metadata.count_genomes), merging
+    each lineage with its parent lineage unless it has an average prevalence of more
+    than `threshold` during any 7-day window.
 
-        if summarised_count == 0:
-            break
+    A mapping previously returned by `collapse_lineages` can be passed instead, to
+    summarise a slice of the counts in the same way as the whole.
+    """
+    if mapping is None:
+        mapping = collapse_lineages(
+            lineage_matrix(counts), threshold, always_interesting
+        )
 
+    data = counts["count"].reset_index()
+    data = data[~data["lineage"].isnull()]  # Filter out missing lineages to start
+    data["lineage"] = data["lineage"].map(mapping)
     return data
 
 
 def summarise_lineage(lin):
-    lineage_parts = lin.split(".")
-
-    if len(lineage_parts) < 3:
-        # We're either one step up from the root of a lineage, or we are at the root of the lineage.
-        root = lineage_parts[0]
-        parent = parent_lineages.get(root)
-
-        if not parent:
-            # Parent lineage either doesn't exist in the data file, or is one of the root lineages (A or B)
-            return lineage_parts[0]
-
-        if isinstance(parent, list):
-            # This happens if the lineage is a recombination of two parents
-            # Pick the one with the longest lineage chain to be the parent,
-            # ie. the most dots in the lineage name. Does not handle ties as is.
-            return max(parent, key=lambda x: len(x.split(".")))
-
-        return parent_lineages[root]
-
-    return ".".join(lineage_parts[:-1])
+    return lineage_index().parent(lin)
 
 
 named_lineages = {
@@ -364,81 +240,79 @@ named_lineages = {
     "BA": "Omicron",
 }
 
+variant_names = PrefixTrie(named_lineages)
+
 lineage_colours = {
-    "Alpha": cycle(
-        [
-            "#3182bd",
-            "#6baed6",
-            "#9ecae1",
-            "#c6dbef",
-        ]
-    ),
-    "Delta": cycle(
-        [
-            "#e6550d",
-            "#fd8d3c",
-            "#fdae6b",
-            "#fdd0a2",
-        ]
-    ),
-    "Omicron": cycle(
-        [
-            "#31a354",
-            "#74c476",
-            "#a1d99b",
-            "#c7e9c0",
-        ]
-    ),
-    "": cycle(Greys[7]),
+    "Alpha": [
+        "#3182bd",
+        "#6baed6",
+        "#9ecae1",
+        "#c6dbef",
+    ],
+    "Delta": [
+        "#e6550d",
+        "#fd8d3c",
+        "#fdae6b",
+        "#fdd0a2",
+    ],
+    "Omicron": [
+        "#31a354",
+        "#74c476",
+        "#a1d99b",
+        "#c7e9c0",
+    ],
+    "": Greys[7],
 }
 
 
-def lineage_prevalence(data):
-    summarised = summarise_lineages(data, always_interesting=["B.1.1.529"])
-    count = summarised.groupby(["sample_date"]).count()["sequence_name"]
-    grouped = (
-        summarised.groupby(["sample_date", "lineage"]).count()["sequence_name"] / count
-    )
+def lineage_prevalence_data(counts, mapping):
+    """Daily prevalence of each lineage in `counts`, as summarised by `mapping`,
+    averaged over 7 days.
+    """
+    summarised = summarise_lineages(counts, mapping=mapping)
+    count = summarised.groupby("sample_date")["count"].sum()
+    grouped = summarised.groupby(["sample_date", "lineage"])["count"].sum() / count
 
-    grouped = grouped.unstack().fillna(0).rolling(7, center=True).mean().reset_index()
+    return grouped.unstack().fillna(0).rolling(7, center=True).mean().reset_index()
 
+
+def lineage_styles(grouped):
+    """Order, legend label and colour of each lineage in prevalence data, grouped
+    by variant.
+    """
     lineage_data = []
     for lin in set(grouped.columns) - {"sample_date"}:
         d = {
             "lineage": lin,
-            "variant": "",
+            "variant": variant_names.match(lin, ""),
             "first_date": grouped[grouped[lin] > 0.05]["sample_date"].min(),
         }
-        for named_lin, name in named_lineages.items():
-            if lin.startswith(named_lin):
-                d["variant"] = name
-                break
         lineage_data.append(d)
 
     lineage_data = list(
         sorted(lineage_data, key=lambda x: (x["variant"], x["first_date"]))
     )
 
-    stackers = []
-    labels = []
-    colours = []
-
+    colours = {variant: cycle(palette) for variant, palette in lineage_colours.items()}
     for lin in lineage_data:
-        stackers.append(lin["lineage"])
         if lin["variant"]:
-            labels.append(f"{lin['lineage']} ({lin['variant']})")
+            lin["label"] = f"{lin['lineage']} ({lin['variant']})"
         else:
-            labels.append(lin["lineage"])
+            lin["label"] = lin["lineage"]
+        lin["colour"] = next(colours[lin["variant"]])
+    return lineage_data
+
 
-        colours.append(next(lineage_colours[lin["variant"]]))
+def lineage_prevalence_graph(grouped, styles, title):
+    styles = [lin for lin in styles if lin["lineage"] in grouped]
 
-    fig = figure(interventions=False, title="UK lineage prevalence")
+    fig = figure(interventions=False, title=title)
     fig.varea_stack(
         source=grouped,
         x="sample_date",
-        stackers=stackers,
-        color=colours,
-        legend_label=labels,
+        stackers=[lin["lineage"] for lin in styles],
+        color=[lin["colour"] for lin in styles],
+        legend_label=[lin["label"] for lin in styles],
         fill_alpha=0.7,
     )
     fig.legend.location = "bottom_left"
@@ -446,3 +320,165 @@ def lineage_prevalence(data):
     fig.y_range.end = 1
     add_provisional(fig, PROVISIONAL_DAYS)
     return fig
+
+
+def uk_lineage_mapping(counts):
+    return collapse_lineages(lineage_matrix(counts), always_interesting=["B.1.1.529"])
+
+
+def lineage_prevalence(counts):
+    grouped = lineage_prevalence_data(counts, uk_lineage_mapping(counts))
+    return lineage_prevalence_graph(
+        grouped, lineage_styles(grouped), "UK lineage prevalence"
+    )
+
+
+def regional_lineage_prevalence(counts):
+    """Lineage prevalence graphs for each sequencing region, keyed by region.
+
+    Lineages are merged as they are for the whole UK, and keep the same colours, so
+    that the graphs can be compared.
+    """
+    mapping = uk_lineage_mapping(counts)
+    styles = lineage_styles(lineage_prevalence_data(counts, mapping))
+
+    graphs = {}
+    for region, region_counts in counts.groupby(level="region"):
+        if region == UNKNOWN_REGION:
+            continue
+        graphs[region] = lineage_prevalence_graph(
+            lineage_prevalence_data(region_counts, mapping),
+            styles,
+            f"{region} lineage prevalence",
+        )
+    return graphs
+
+
+def clade_matrix(matrix):
+    """Turn a lineage/date count matrix, as returned by `lineage_matrix`, into counts
+    for each lineage including all of its descendants. Ancestors which have no
+    sequences of their own are added as rows.
+    """
+    index = lineage_index()
+    rows, clades = [], []
+    for row, lineage in enumerate(matrix.index):
+        for clade in (lineage,) + index.ancestors(lineage):
+            rows.append(row)
+            clades.append(clade)
+
+    codes, names = pd.factorize(pd.Series(clades, dtype=object))
+    values = np.zeros((len(names), matrix.shape[1]), dtype=matrix.values.dtype)
+    np.add.at(values, codes, matrix.values[rows])
+    return pd.DataFrame(values, index=names, columns=matrix.columns)
+
+
+def lineage_growth_rates(
+    counts, window=GROWTH_WINDOW_DAYS, min_sequences=GROWTH_MIN_SEQUENCES
+):
+    """Estimate the growth advantage of each lineage over the rest of its parent
+    lineage, from counts as returned by cog_metadata.count_genomes.
+
+    The log odds of a sequence in the parent being in the lineage is assumed to change
+    linearly with time (a logistic model). It's fitted by weighted least squares on
+    the empirical log odds for each day in the last `window` days, weighted by their
+    inverse variance. The fits for all lineages are solved in one batch.
+
+    Returns a DataFrame indexed by lineage, sorted by growth rate, with the daily
+    logistic growth rate, the implied weekly growth advantage and its 95% interval.
+    """
+    clades = clade_matrix(lineage_matrix(counts).iloc[:, -window:])
+    index = lineage_index()
+    lineages = [lineage for lineage in clades.index if index.parent(lineage) != lineage]
+    parents = [index.parent(lineage) for lineage in lineages]
+
+    n = clades.loc[lineages].values.astype(float)
+    rest = clades.loc[parents].values - n
+    enough = (
+        (n.sum(axis=1) >= min_sequences)
+        & (rest.sum(axis=1) >= min_sequences)
+        & ((n + rest > 0).sum(axis=1) >= 3)
+    )
+    n, rest = n[enough], rest[enough]
+
+    # Empirical log odds, with 0.5 added to each count so that days where the lineage
+    # or the rest of its parent wasn't seen can still be used.
+    y = np.log((n + 0.5) / (rest + 0.5))
+    w = np.where(n + rest > 0, 1 / (1 / (n + 0.5) + 1 / (rest + 0.5)), 0)
+    t = np.arange(n.shape[1]) - (n.shape[1] - 1)
+
+    # Normal equations for y = a + r * t, for every lineage at once. Solving against
+    # [X'Wy | I] gives the coefficients and their covariance together.
+    sw, swt, swtt = w.sum(axis=1), (w * t).sum(axis=1), (w * t * t).sum(axis=1)
+    xwx = np.stack([np.stack([sw, swt], axis=-1), np.stack([swt, swtt], axis=-1)], 1)
+    xwy = np.stack([(w * y).sum(axis=1), (w * t * y).sum(axis=1)], axis=-1)
+    rhs = np.concatenate([xwy[:, :, None], np.broadcast_to(np.eye(2), xwx.shape)], 2)
+    solution = np.linalg.solve(xwx, rhs)
+    coefficients, covariance = solution[:, :, 0], solution[:, :, 1:]
+
+    # Allow for overdispersion, as daily counts vary more than binomial sampling
+    # would suggest.
+    fitted = coefficients[:, :1] + coefficients[:, 1:] * t
+    dof = np.maximum((w > 0).sum(axis=1) - 2, 1)
+    dispersion = np.maximum((w * (y - fitted) ** 2).sum(axis=1) / dof, 1)
+
+    rate = coefficients[:, 1]
+    error = np.sqrt(covariance[:, 1, 1] * dispersion)
+    rates = pd.DataFrame(
+        {
+            "parent": np.array(parents, dtype=object)[enough],
+            "sequences": n.sum(axis=1).astype(int),
+            "rate": rate,
+            "advantage": np.expm1(7 * rate),
+            "advantage_low": np.expm1(7 * (rate - 1.96 * error)),
+            "advantage_high": np.expm1(7 * (rate + 1.96 * error)),
+        },
+        index=pd.Index(np.array(lineages, dtype=object)[enough], name="lineage"),
+    )
+    return rates.sort_values("rate", ascending=False)
+
+
+def lineage_growth_graph(rates, limit=30):
+    """Plot the weekly growth advantage of the fastest-growing lineages."""
+    rates = rates.head(limit).iloc[::-1].reset_index()
+    rates["variant"] = [variant_names.match(lin, "") for lin in rates["lineage"]]
+    rates["colour"] = [
+        lineage_colours[variant][0] if variant else "#636363"
+        for variant in rates["variant"]
+    ]
+
+    fig = bokeh_figure(
+        y_range=list(rates["lineage"]),
+        width=1200,
+        height=len(rates) * 20 + 100,
+        title=f"Weekly growth advantage over parent lineage (last {GROWTH_WINDOW_DAYS}"
+        " days)",
+        sizing_mode="scale_width",
+        tools="",
+        toolbar_location=None,
+    )
+    fig.add_tools(
+        HoverTool(
+            tooltips=[
+                ("Lineage", "@lineage"),
+                ("Parent", "@parent"),
+                ("Advantage", "@advantage{+0%}"),
+                ("95% interval", "@advantage_low{+0%} to @advantage_high{+0%}"),
+                ("Sequences", "@sequences{0,0}"),
+            ],
+            toggleable=False,
+        )
+    )
+    fig.segment(
+        x0="advantage_low",
+        x1="advantage_high",
+        y0="lineage",
+        y1="lineage",
+        color="colour",
+        line_width=2,
+        source=rates,
+    )
+    fig.circle(x="advantage", y="lineage", color="colour", size=7, source=rates)
+    fig.add_layout(Span(location=0, dimension="height", line_color="#999999"))
+    fig.xaxis.formatter = NumeralTickFormatter(format="+0%")
+    fig.ygrid.grid_line_color = None
+    return fig
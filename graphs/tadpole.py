@@ -4,6 +4,8 @@ from bokeh.plotting import figure as bokeh_figure
 from bokeh.models.tools import HoverTool
 from bokeh.transform import factor_cmap
 from bokeh.models import NumeralTickFormatter
+from geography import nation, name
+from derived import series
 from .common import xr_to_cds
 from . import NATION_COLOURS
 
@@ -16,7 +18,7 @@ def la_tadpole(eng_by_gss, vax_uptake, populations, vaccine_shift=14, tail_days=
     vax_vs_cases = xr.merge(
         [
             vax,
-            (eng_by_gss.diff("date") * 100000 * 7).rolling(date=7).mean()["cases_norm"],
+            series(eng_by_gss, "weekly_cases_per_100k").rename("cases_norm"),
         ]
     ).ffill("date")
     # Drop the most recent 4 days of data to remove incomplete
@@ -24,21 +26,10 @@ def la_tadpole(eng_by_gss, vax_uptake, populations, vaccine_shift=14, tail_days=
         vax_vs_cases.date < vax_vs_cases.date.max() - pd.Timedelta(days=3), drop=True
     )
 
-    gss_prefix = {
-        "E": "England",
-        "S": "Scotland",
-        "N": "Northern Ireland",
-        "W": "Wales",
-    }
-
-    vax_vs_cases["nation"] = [
-        gss_prefix[str(g.values)[0]] for g in vax_vs_cases.gss_code
-    ]
-
-    lad_lookup = pd.read_csv("data/lads.csv").set_index("LAD19CD")
-    vax_vs_cases["name"] = [
-        lad_lookup.loc[str(g.data)]["LAD19NM"] for g in vax_vs_cases.gss_code
-    ]
+    gss_codes = vax_vs_cases["gss_code"].values
+    vax_vs_cases = vax_vs_cases.assign_coords(
+        nation=("gss_code", nation(gss_codes)), name=("gss_code", name(gss_codes))
+    )
 
     history = vax_vs_cases.sel(
         date=slice(
@@ -0,0 +1,189 @@
+""" Detail pages for each local authority.
+
+    The shared datasets are sliced into a small bundle of arrays per area once, and the
+    pages are rendered across a process pool. Building and serialising the Bokeh graphs
+    is most of the cost of a page, so the serialised graphs are cached on disk, keyed
+    on the area's data, and reused while it doesn't change.
+"""
+import os
+import json
+import logging
+import hashlib
+import numpy as np
+import xarray as xr
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+
+from download import CACHE_DIR
+from derived import series, take_counts, add_counts
+from geography import name as area_name
+from map import latest_weekly
+from graphs import la_cases_graph, la_positivity_graph, case_ratio
+from template import graph_items, render_template
+
+FRAGMENT_DIR = os.path.join(CACHE_DIR, "la_pages")
+
+# Derived series of each area which its page uses, sliced from the shared dataset.
+DERIVED_SERIES = [
+    "daily_cases",
+    "cases_rolling_7",
+    "weekly_cases",
+    "weekly_cases_per_100k",
+]
+
+# Increment to invalidate the cached graphs when the graphs change.
+FRAGMENT_VERSION = 3
+
+log = logging.getLogger(__name__)
+
+
+def slice_areas(eng_by_gss, positivity, vaccine_uptake):
+    """ Split the datasets into a dict of values for each area in `eng_by_gss`. """
+    gss_codes = eng_by_gss["gss_code"].values
+    names = area_name(gss_codes)
+    cases = eng_by_gss["cases"].transpose("gss_code", "date").values
+    cases_norm = eng_by_gss["cases_norm"].transpose("gss_code", "date").values
+    derived = {
+        name: series(eng_by_gss, name).transpose("gss_code", "date").values
+        for name in DERIVED_SERIES
+    }
+    positivity = positivity["positivity"].reindex(gss_code=gss_codes)
+    positivity_values = positivity.transpose("gss_code", "date").values
+    vaccine_uptake = vaccine_uptake.reindex(gss_code=gss_codes)
+
+    return [
+        {
+            "gss_code": gss_code,
+            "name": names[i],
+            "dates": eng_by_gss["date"].values,
+            "cases": cases[i],
+            "cases_norm": cases_norm[i],
+            "derived": {name: values[i] for name, values in derived.items()},
+            "positivity_dates": positivity["date"].values,
+            "positivity": positivity_values[i],
+            "first_doses": float(vaccine_uptake["first"].values[i]),
+            "second_doses": float(vaccine_uptake["second"].values[i]),
+        }
+        for i, gss_code in enumerate(gss_codes)
+    ]
+
+
+def fragment_key(area):
+    """ Key for an area's cached graphs, which changes when its data does. The graphs'
+        x-axis ranges depend on today's date, so they're also rebuilt each day.
+    """
+    digest = hashlib.sha1(
+        f"{FRAGMENT_VERSION}:{date.today()}:{area['name']}".encode("utf-8")
+    )
+    for field in ("dates", "cases", "positivity_dates", "positivity"):
+        digest.update(np.ascontiguousarray(area[field]).tobytes())
+    return digest.hexdigest()
+
+
+def area_graphs(area):
+    """ Serialised graphs for an area's page. """
+    cases = xr.Dataset(
+        {
+            name: (("location", "date"), values[np.newaxis, :])
+            for name, values in dict(area["derived"], cases=area["cases"]).items()
+        },
+        coords={"location": [area["name"]], "date": area["dates"]},
+    )
+    positivity = xr.DataArray(
+        area["positivity"],
+        dims=["date"],
+        coords={"date": area["positivity_dates"]},
+    ).dropna("date")
+
+    return graph_items(
+        {
+            "cases": la_cases_graph(cases.sel(location=area["name"]), area["name"]),
+            "positivity": la_positivity_graph(positivity, area["name"])
+            if len(positivity)
+            else None,
+            "case_ratio": case_ratio(cases[["cases"]], location=area["name"]),
+        }
+    )
+
+
+def cached_area_graphs(area):
+    """ Serialised graphs for an area's page, from the cache if its data hasn't
+        changed. Returns the graphs and whether they were cached.
+    """
+    path = os.path.join(FRAGMENT_DIR, f"{area['gss_code']}.json")
+    key = fragment_key(area)
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached["key"] == key:
+            return cached["items"], True
+    except (OSError, ValueError, KeyError):
+        pass
+
+    items = area_graphs(area)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"key": key, "items": items}, f)
+    os.replace(path + ".tmp", path)
+    return items, False
+
+
+def render_area_page(area, sources, provisional_days):
+    """ Render the page for an area, returning whether its graphs were cached, and
+        the derived series hits and misses of rendering it.
+    """
+    items, cached = cached_area_graphs(area)
+
+    # Weekly totals are taken as they are on the map.
+    weekly_cases = latest_weekly(area["derived"]["weekly_cases"], provisional_days)
+    weekly_rate = latest_weekly(
+        area["derived"]["weekly_cases_per_100k"], provisional_days
+    )
+    # Areas without a population have no rate.
+    if np.isnan(area["cases_norm"]).all():
+        weekly_rate = None
+    positivity = area["positivity"][~np.isnan(area["positivity"])]
+
+    render_template(
+        f"la/{area['gss_code']}.html",
+        items=items,
+        template="la.html",
+        area_name=area["name"],
+        graph_ids=[item["target_id"] for item in items],
+        weekly_cases=int(weekly_cases),
+        weekly_rate=weekly_rate,
+        positivity=positivity[-1] if len(positivity) else None,
+        first_doses=area["first_doses"],
+        second_doses=area["second_doses"],
+        sources=sources,
+    )
+    return cached, take_counts()
+
+
+def render_area_pages(
+    eng_by_gss, positivity, vaccine_uptake, sources, provisional_days, processes=None
+):
+    """ Render a page for every area in `eng_by_gss` across a process pool. Weekly
+        totals are shown as on the map, ignoring the last `provisional_days` unless
+        they're higher.
+    """
+    os.makedirs(FRAGMENT_DIR, exist_ok=True)
+    areas = slice_areas(eng_by_gss, positivity, vaccine_uptake)
+
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(
+            pool.map(
+                render_area_page,
+                areas,
+                [sources] * len(areas),
+                [provisional_days] * len(areas),
+                chunksize=8,
+            )
+        )
+    cached = [cached for cached, _ in results]
+    for _, counts in results:
+        add_counts(counts)
+    log.info(
+        "Rendered %d local authority pages, reusing graphs for %d",
+        len(areas),
+        sum(cached),
+    )
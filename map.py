@@ -1,61 +1,244 @@
+import numpy as np
+import pandas as pd
+from derived import series
+
+# Lower bounds of the classes in the colour ramp for each map layer, which must match
+# the ramps in output/map.js. Values below the last bound fall into the last class.
+COLOUR_RAMPS = {
+    "cases_abs": [1000, 750, 500, 250, 100, 75, 50, 25, 10],
+    "cases_rel": [100, 50, 25, 10, 2, -2, -10, -25, -50, -100, -110],
+    "positivity": [20, 10, 6, 3, 1, 0],
+    "vaccine": [90, 80, 70, 60, 50, 40, 0],
+}
+
+# Class of areas which have no value for a layer, and aren't coloured.
+NO_CLASS = 255
+
+# Values are sent as integers in units of 1/scale, which is the precision they're
+# displayed with.
+SCALES = {"prevalence": 100, "change": 100, "positivity": 10, "doses": 10}
+
+# Geography levels the map can be built at: the layer of the map's vector tiles which
+# holds the areas, and the properties of its features with the code and name of each.
+# Levels with a detail page for each area give the prefix of the pages' URLs. The map
+# is split by region, and region_lookup names the method of geography.Geography which
+# finds the region of each area.
+# Adding a level needs tiles for its areas, cases data with a cases_norm variable keyed
+# by the same codes, and a region lookup for those codes. MSOAs, for example, would be
+# looked up through the local authority each is in.
+GEOGRAPHY_LEVELS = {
+    "ltla": {
+        "source_layer": "local_authorities",
+        "code_property": "lad19cd",
+        "name_property": "lad19nm",
+        "page_prefix": "la/",
+        "region_lookup": "nhs_region",
+    },
+}
+
+
+def _by_area(data_array, gss_codes):
+    """ Values of `data_array` as a (gss_code, ...) numpy array, in the order of
+        `gss_codes`, with a mask of which areas it has data for.
+    """
+    present = np.isin(gss_codes, data_array["gss_code"].values)
+    dims = ["gss_code"] + [dim for dim in data_array.dims if dim != "gss_code"]
+    values = data_array.reindex(gss_code=gss_codes).transpose(*dims).values
+    return values, present
+
+
+def split_by_region(data, area_regions):
+    """ Split `data` into (region, data) pairs, given the region of each of its areas,
+        so that the map can be built and loaded a region at a time. Areas with no
+        region are put in "Other".
+    """
+    regions = pd.Series(area_regions, dtype=object).fillna("Other").values
+    for region in np.unique(regions):
+        yield region, data.isel(gss_code=np.flatnonzero(regions == region))
+
+
+def quantise(values, scale=1):
+    """ Round an array of values to integers in units of 1/`scale`, returning an
+        object array of ints, with None for missing values.
+    """
+    values = np.round(values * scale)
+    missing = np.isnan(values)
+    result = np.where(missing, 0, values).astype(np.int64).astype(object)
+    result[missing] = None
+    return result
+
+
+def delta_encode(values, scale=1):
+    """ Quantise a (area, date) array of values, and encode each area's values as
+        differences from the previous one. Missing values are None, and are skipped
+        when taking differences.
+    """
+    values = np.round(values * scale)
+    days = np.arange(values.shape[1])
+    # Forward-fill each row, so each value is differenced against the last present one.
+    last_present = np.maximum.accumulate(np.where(np.isnan(values), 0, days), axis=1)
+    filled = np.take_along_axis(values, last_present, axis=1)
+    previous = np.concatenate([np.zeros((len(values), 1)), filled[:, :-1]], axis=1)
+    return quantise(values - np.nan_to_num(previous))
+
+
+def colour_classes(values, ramp):
+    """ Index of the colour ramp class of each value, or NO_CLASS if it's missing. """
+    above = values[:, None] >= np.array(ramp)
+    classes = np.where(above.any(axis=1), above.argmax(axis=1), len(ramp) - 1)
+    return np.where(np.isnan(values), NO_CLASS, classes).astype(np.uint8)
+
+
+def latest_weekly(weekly, provisional_days):
+    """ Latest values of weekly totals by date, along the last axis of `weekly`. The
+        latest days are incomplete, so unless `provisional_days` is None, the total
+        from that many days ago is used where it's higher.
+    """
+    latest = weekly[..., -1]
+    if provisional_days is not None:
+        latest = np.maximum(latest, weekly[..., -provisional_days])
+    return latest
+
+
 def map_data(data, positivity, provisional_days, vaccine_uptake):
+    """ Build the hotspot map payload: a column for each field, with a value for each
+        area in `gss_code`. Cases histories are delta-encoded, and the colour class of
+        each area is included for each layer.
+    """
     history_days = 44
 
-    data = data.ffill("date").fillna(0).diff("date")
-    # Filter out numbers below 0 which happen when cases are un-reported.
-    data = data.where(data > 0, 0)
-
-    weekly = data.rolling(date=7).sum()
-    weekly = weekly.where(weekly > 0, 0)
-
-    result = {}
-    for gss_code in weekly["gss_code"].values:
-        ser = weekly.sel(gss_code=gss_code)
-        cases = ser["cases"].values[-1]
-        cases_norm = ser["cases_norm"].values[-1]
-
-        change = ser["cases_norm"].values[-1] - ser["cases_norm"].values[-8]
-
-        if provisional_days is not None:
-            cases = max(
-                cases,
-                ser["cases"].values[-provisional_days],
-            )
-            cases_norm = max(
-                cases_norm,
-                ser["cases_norm"].values[-provisional_days],
-            )
-            change = max(
-                change,
-                ser["cases_norm"].values[-provisional_days]
-                - ser["cases_norm"].values[-(provisional_days + 7)],
-            )
-
-        history = data.sel(gss_code=gss_code)["cases"].values[-history_days:]
-
-        if gss_code in positivity.gss_code:
-            pos = positivity.sel(gss_code=gss_code)["positivity"][-1].item()
-            positivity_history = list(positivity.sel(gss_code=gss_code)["positivity"].values[-history_days:])
-        else:
-            pos = None
-            positivity_history = None
-
-        result[gss_code] = {
-            "prevalence": cases_norm,
-            "change": change,
-            "positivity": pos,
-            "positivity_history": positivity_history,
-            "cases": int(cases),
-            "history": list(map(int, history)),
-            "provisional_days": provisional_days,
-        }
+    gss_codes = data["gss_code"].values
+    weekly_cases = series(data, "weekly_cases").transpose("gss_code", "date").values
+    weekly_rate = (
+        series(data, "weekly_cases_per_100k").transpose("gss_code", "date").values
+    )
 
-        if gss_code in vaccine_uptake['gss_code']:
-            result[gss_code]["first_doses"] = float(vaccine_uptake.sel(gss_code=gss_code)['first'].data)
-            result[gss_code]["second_doses"] = float(vaccine_uptake.sel(gss_code=gss_code)['second'].data)
-            result[gss_code]["combined_doses"] = float(
-                vaccine_uptake.sel(gss_code=gss_code)['first'].data * 0.4
-                + vaccine_uptake.sel(gss_code=gss_code)['second'].data * 0.6
-            )
+    cases = latest_weekly(weekly_cases, provisional_days)
+    rate = latest_weekly(weekly_rate, provisional_days)
+    change = weekly_rate[:, -1] - weekly_rate[:, -8]
 
-    return result
+    if provisional_days is not None:
+        change = np.maximum(
+            change,
+            weekly_rate[:, -provisional_days] - weekly_rate[:, -(provisional_days + 7)],
+        )
+
+    history = series(data, "daily_cases").transpose("gss_code", "date").values
+    history = history[:, -history_days:]
+
+    # Areas without positivity or vaccine uptake data are filled with NaN.
+    positivity, has_positivity = _by_area(positivity["positivity"], gss_codes)
+    positivity_history = positivity[:, -history_days:]
+    positivity = positivity[:, -1]
+
+    first_doses, _ = _by_area(vaccine_uptake["first"], gss_codes)
+    second_doses, _ = _by_area(vaccine_uptake["second"], gss_codes)
+    combined_doses = first_doses * 0.4 + second_doses * 0.6
+
+    # Values are coloured as they're displayed: rounded.
+    prevalence = quantise(rate, SCALES["prevalence"])
+    change = quantise(change, SCALES["change"])
+    classes = {
+        "cases_abs": colour_classes(
+            prevalence.astype(float) / SCALES["prevalence"], COLOUR_RAMPS["cases_abs"]
+        ),
+        "cases_rel": colour_classes(
+            change.astype(float) / SCALES["change"], COLOUR_RAMPS["cases_rel"]
+        ),
+        # Areas with zero positivity or vaccine uptake are left uncoloured.
+        "positivity": colour_classes(
+            np.where(positivity != 0, positivity, np.nan), COLOUR_RAMPS["positivity"]
+        ),
+        "vaccine": colour_classes(
+            np.where(combined_doses != 0, combined_doses, np.nan),
+            COLOUR_RAMPS["vaccine"],
+        ),
+    }
+
+    positivity_history = [
+        area_history if has_positivity[i] else None
+        for i, area_history in enumerate(
+            delta_encode(positivity_history, SCALES["positivity"]).tolist()
+        )
+    ]
+
+    return {
+        "provisional_days": provisional_days,
+        "scales": SCALES,
+        "gss_code": gss_codes.tolist(),
+        "cases": cases.astype(int).tolist(),
+        "prevalence": prevalence.tolist(),
+        "change": change.tolist(),
+        "history": delta_encode(history.astype(int)).tolist(),
+        "positivity": quantise(positivity, SCALES["positivity"]).tolist(),
+        "positivity_history": positivity_history,
+        "first_doses": quantise(first_doses, SCALES["doses"]).tolist(),
+        "second_doses": quantise(second_doses, SCALES["doses"]).tolist(),
+        "combined_doses": quantise(combined_doses, SCALES["doses"]).tolist(),
+        "classes": {layer: values.tolist() for layer, values in classes.items()},
+    }
+
+
+def history_months(dates):
+    """ The months of the map's history, as (month, slice of `dates`) pairs. """
+    month_of_day = dates.astype("datetime64[M]")
+    for month in np.unique(month_of_day):
+        days = np.flatnonzero(month_of_day == month)
+        yield str(month), slice(days[0], days[-1] + 1)
+
+
+def map_history(data, positivity):
+    """ Weekly prevalence, weekly change and positivity for every area on every day,
+        for the map's time slider, computed for all days at once.
+
+        The result is split into chunks by month, so that only the months being
+        viewed need to be loaded. Each chunk holds (area, day) arrays, flattened in
+        row-major order, of the values and their colour classes. Areas are in the
+        order of the top-level `gss_code`.
+    """
+    gss_codes = data["gss_code"].values
+    dates = data["date"].values
+
+    prevalence = (
+        series(data, "weekly_cases_per_100k").transpose("gss_code", "date").values
+    )
+    change = np.full_like(prevalence, np.nan)
+    change[:, 7:] = prevalence[:, 7:] - prevalence[:, :-7]
+    positivity = (
+        positivity["positivity"]
+        .reindex(gss_code=gss_codes, date=dates)
+        .transpose("gss_code", "date")
+        .values
+    )
+
+    prevalence = quantise(prevalence, SCALES["prevalence"])
+    change = quantise(change, SCALES["change"])
+    classes = {
+        "cases_abs": colour_classes(
+            prevalence.astype(float).ravel() / SCALES["prevalence"],
+            COLOUR_RAMPS["cases_abs"],
+        ).reshape(prevalence.shape),
+        "cases_rel": colour_classes(
+            change.astype(float).ravel() / SCALES["change"], COLOUR_RAMPS["cases_rel"]
+        ).reshape(change.shape),
+        "positivity": colour_classes(
+            np.where(positivity != 0, positivity, np.nan).ravel(),
+            COLOUR_RAMPS["positivity"],
+        ).reshape(positivity.shape),
+    }
+    positivity = quantise(positivity, SCALES["positivity"])
+
+    months = {}
+    for month, days in history_months(dates):
+        months[month] = {
+            "dates": [str(day) for day in dates[days].astype("datetime64[D]")],
+            "prevalence": prevalence[:, days].ravel().tolist(),
+            "change": change[:, days].ravel().tolist(),
+            "positivity": positivity[:, days].ravel().tolist(),
+            "classes": {
+                layer: values[:, days].ravel().tolist()
+                for layer, values in classes.items()
+            },
+        }
+
+    return {"gss_code": gss_codes.tolist(), "scales": SCALES, "months": months}
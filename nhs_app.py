@@ -1,26 +1,117 @@
+import os
+import logging
 import pandas as pd
-import requests
 import sqlite3
-import tempfile
 import json
-from collections import defaultdict
 from datetime import datetime, timezone
+from functools import wraps
+from download import fetch, CACHE_DIR
 
 URL = "https://files.russss.dev/nhs_covid19_app_data.db"
 
+REPLICA_PATH = os.path.join(CACHE_DIR, "nhs_app_replica.db")
+
+# Tables are only ever appended to, so each is synced by copying the rows from the
+# highest value of this column already in the replica onwards. Values aren't unique,
+# and rows with the highest value may have been added since the last sync, so rows
+# with that value are replaced rather than skipped.
+SYNC_COLUMNS = {
+    "exposure_keys": "export_date",
+    "risky_venues": "export_date",
+    "home_test_availability": "date",
+    "walk_in_pcr_availability": "date",
+}
+
+log = logging.getLogger(__name__)
+
+
+def check_database(path):
+    """ Raise if the file at `path` isn't an intact SQLite database. """
+    with open(path, "rb") as f:
+        if f.read(16) != b"SQLite format 3\x00":
+            raise ValueError("not an SQLite database")
+
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise ValueError(f"integrity check failed: {result}")
+
+
+def sync_replica(snapshot_path, replica_path=REPLICA_PATH):
+    """ Bring the persistent replica at `replica_path` up to date with the downloaded
+        database at `snapshot_path`, and return a connection to the replica.
+    """
+    conn = sqlite3.connect(f"file:{replica_path}", uri=True)
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_state (snapshot TEXT)")
+
+    stat = os.stat(snapshot_path)
+    snapshot_id = f"{stat.st_size}:{stat.st_mtime_ns}"
+    if conn.execute("SELECT snapshot FROM sync_state").fetchone() == (snapshot_id,):
+        return conn
+
+    # The snapshot is opened read-only so it stays byte-identical to the server's
+    # copy, which the download cache revalidates against.
+    conn.execute(
+        "ATTACH DATABASE ? AS snapshot",
+        (f"file:{os.path.abspath(snapshot_path)}?mode=ro",),
+    )
+    with conn:
+        for table, column in SYNC_COLUMNS.items():
+            exists = conn.execute(
+                "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                (table,),
+            ).fetchone()
+            if not exists:
+                (schema,) = conn.execute(
+                    "SELECT sql FROM snapshot.sqlite_master"
+                    " WHERE type = 'table' AND name = ?",
+                    (table,),
+                ).fetchone()
+                conn.execute(schema)
+                conn.execute(f"CREATE INDEX {table}_{column} ON {table} ({column})")
+
+            (high_water,) = conn.execute(
+                f"SELECT max({column}) FROM main.{table}"
+            ).fetchone()
+            conn.execute(f"DELETE FROM main.{table} WHERE {column} >= ?", (high_water,))
+            cur = conn.execute(
+                f"INSERT INTO main.{table} SELECT * FROM snapshot.{table}"
+                f" WHERE {column} >= coalesce(?, -1)",
+                (high_water,),
+            )
+            log.info("Synced %d rows into %s", cur.rowcount, table)
+
+        conn.execute("DELETE FROM sync_state")
+        conn.execute("INSERT INTO sync_state VALUES (?)", (snapshot_id,))
+    conn.execute("DETACH DATABASE snapshot")
+    return conn
+
+
+def memoise(method):
+    """ Cache the results of an NHSAppData query method on the instance. """
+
+    @wraps(method)
+    def wrapper(self, *args):
+        key = (method.__name__,) + args
+        if key not in self._memo:
+            self._memo[key] = method(self, *args)
+        return self._memo[key]
+
+    return wrapper
+
 
 class NHSAppData:
     def __init__(self):
-        self.dbfile = tempfile.NamedTemporaryFile()
-        res = requests.get(URL)
-        res.raise_for_status()
-        self.dbfile.write(res.content)
-        self.conn = sqlite3.connect(self.dbfile.name)
+        path = fetch(URL, verify=check_database)
+        self.conn = sync_replica(path)
         self.cur = self.conn.cursor()
+        self._memo = {}
 
     def __del__(self):
         self.conn.close()
-        self.dbfile.close()
 
     def exposures(self):
         self.cur.execute(
@@ -51,6 +142,57 @@ class NHSAppData:
         )
         return data
 
+    @memoise
+    def exposure_counts(self, by="export"):
+        """ Count exposure keys by day of export or, if `by` is "interval", by day
+            of broadcast and transmission risk level.
+        """
+        if by == "export":
+            data = pd.read_sql_query(
+                "SELECT date(export_date, 'unixepoch') AS export_date,"
+                " count(*) AS count FROM exposure_keys GROUP BY 1 ORDER BY 1",
+                self.conn,
+                parse_dates=["export_date"],
+            )
+            return data.set_index("export_date")["count"]
+        elif by == "interval":
+            data = pd.read_sql_query(
+                "SELECT date(rolling_start_interval_number * 600, 'unixepoch')"
+                " AS interval_start, transmission_risk_level, count(*) AS count"
+                " FROM exposure_keys GROUP BY 1, 2 ORDER BY 1, 2",
+                self.conn,
+                parse_dates=["interval_start"],
+            )
+            data = data.pivot(
+                index="interval_start",
+                columns="transmission_risk_level",
+                values="count",
+            )
+            data.columns = [str(level) for level in data.columns]
+            return data
+        raise ValueError(f"Unknown grouping {by}")
+
+    @memoise
+    def risky_venue_counts(self):
+        """ Count risky venue notifications by day of export and message type. """
+        data = pd.read_sql_query(
+            "SELECT date(export_date, 'unixepoch') AS export_date, message_type,"
+            " count(*) AS count FROM risky_venues GROUP BY 1, 2 ORDER BY 1, 2",
+            self.conn,
+            parse_dates=["export_date"],
+        )
+        return data.pivot(
+            index="export_date", columns="message_type", values="count"
+        ).fillna(0)
+
+    @memoise
+    def risky_venue_totals(self):
+        """ Return the total number of risky venue notifications and the number of
+            distinct venues notified.
+        """
+        self.cur.execute("SELECT count(id), count(DISTINCT id) FROM risky_venues")
+        return self.cur.fetchone()
+
     def risky_venues(self):
         self.cur.execute(
             """SELECT export_date, id, risky_from, risky_until, message_type
@@ -76,26 +218,93 @@ class NHSAppData:
         return data.set_index('date')
 
     def walk_in_availability(self):
-        self.cur.execute("SELECT date, availability FROM walk_in_pcr_availability")
-        data = defaultdict(list)
-        for row in self.cur:
-            availability = json.loads(row[1])
-            date = pd.to_datetime(availability['lastUpdated']).tz_localize(None)
-            for nation in availability['availability']:
-                if 'items' not in nation:
-                    # Scotland has no breakdown
-                    data['date'].append(date)
-                    data['area'].append(nation['name'])
-                    data['availability'].append(nation['availability']['citizen'])
-                else:
-                    for region in nation['items']:
-                        # Non-English nations have an "All regions" parent group for some reason.
-                        if region['name'] == 'All regions':
-                            name = nation['name']
-                        else:
-                            name = region['name']
-                        data['date'].append(date)
-                        data['area'].append(name)
-                        data['availability'].append(region['availability']['citizen'])
-
-        return pd.DataFrame.from_dict(data).set_index('date')
+        """ Per-area walk-in PCR test availability.
+
+            Decoded rows are cached in the replica, so only snapshots from the last
+            one decoded onwards need to be parsed. Rows from the last one are decoded
+            again, as more of them may have been synced since.
+        """
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS walk_in_availability_decoded"
+            " (source_date, date TEXT, area TEXT, availability TEXT)"
+        )
+        (high_water,) = self.conn.execute(
+            "SELECT max(source_date) FROM walk_in_availability_decoded"
+        ).fetchone()
+        self.cur.execute(
+            "SELECT date, availability FROM walk_in_pcr_availability"
+            " WHERE date >= coalesce(?, -1)",
+            (high_water,),
+        )
+        rows = self.cur.fetchall()
+        if rows:
+            decoded = decode_walk_in_availability(rows)
+            decoded["date"] = decoded["date"].dt.strftime("%Y-%m-%d %H:%M:%S")
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM walk_in_availability_decoded WHERE source_date >= ?",
+                    (high_water,),
+                )
+                self.conn.executemany(
+                    "INSERT INTO walk_in_availability_decoded VALUES (?, ?, ?, ?)",
+                    decoded[["source_date", "date", "area", "availability"]].itertuples(
+                        index=False
+                    ),
+                )
+
+        data = pd.read_sql_query(
+            "SELECT date, area, availability FROM walk_in_availability_decoded"
+            " ORDER BY source_date",
+            self.conn,
+            parse_dates=["date"],
+        )
+        return data.set_index("date")
+
+
+def decode_walk_in_availability(rows):
+    """ Flatten (date, availability JSON) rows from walk_in_pcr_availability into
+        columns of source_date, date, area and availability.
+    """
+    source_dates = [row[0] for row in rows]
+    # Parse every row with a single call rather than one json.loads per row.
+    snapshots = json.loads("[" + ",".join(row[1] for row in rows) + "]")
+    for source_date, snapshot in zip(source_dates, snapshots):
+        snapshot["source_date"] = source_date
+
+    nations = pd.json_normalize(
+        snapshots, record_path="availability", meta=["source_date", "lastUpdated"]
+    )
+    if "items" not in nations:
+        nations["items"] = None
+
+    # Scotland has no breakdown, so is reported at nation level.
+    whole_nations = nations[nations["items"].isnull()]
+    whole_nations = pd.DataFrame(
+        {
+            "source_date": whole_nations["source_date"],
+            "lastUpdated": whole_nations["lastUpdated"],
+            "area": whole_nations["name"],
+            "availability": whole_nations["availability.citizen"],
+        }
+    )
+
+    nation_regions = nations[nations["items"].notnull()].explode("items")
+    items = pd.json_normalize(nation_regions["items"].tolist())
+    regions = pd.DataFrame(
+        {
+            "source_date": nation_regions["source_date"].values,
+            "lastUpdated": nation_regions["lastUpdated"].values,
+            # Non-English nations have an "All regions" parent group for some reason.
+            "area": items["name"]
+            .where(items["name"] != "All regions", nation_regions["name"].values)
+            .values,
+            "availability": items["availability.citizen"].values,
+        }
+    )
+
+    data = pd.concat([whole_nations, regions], ignore_index=True)
+    # Drop the UTC offset to keep the local time, as reported.
+    data["date"] = pd.to_datetime(
+        data.pop("lastUpdated").str.replace(r"(Z|[+-]\d\d:?\d\d)$", "", regex=True)
+    )
+    return data
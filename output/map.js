@@ -132,52 +132,17 @@ function getColour(ramp, value) {
   return ramp[ramp.length - 1][2];
 }
 
-function styleExpression(data, propname) {
-  var expression = ["match", ["get", propname]];
-
-  for (const gss_id in data) {
-    const prevalence = (data[gss_id]["prevalence"] * 100000).toFixed(2);
-    const colour = getColour(colour_ramp, prevalence);
-
-    expression.push(gss_id, colour);
-    if (gss_id == "E09000012") {
-      expression.push("E09000001", colour);
-    } else if (gss_id == "E06000052") {
-      expression.push("E06000053", colour);
-    }
-  }
-
-  expression.push("#ffffff");
-  return expression;
-}
-
-function diffStyleExpression(data, propname) {
-  var expression = ["match", ["get", propname]];
-
-  for (const gss_id in data) {
-    const change = (data[gss_id].change * 100000).toFixed(2);
-    var colour = getColour(change_colour_ramp, change);
-
-    expression.push(gss_id, colour);
-    if (gss_id == "E09000012") {
-      expression.push("E09000001", colour);
-    } else if (gss_id == "E06000052") {
-      expression.push("E06000053", colour);
-    }
-  }
-  expression.push("#ffffff");
-  return expression;
-}
+// Class of areas with no value for a layer (see NO_CLASS in map.py).
+const NO_CLASS = 255;
 
-function positivityStyleExpression(data, propname) {
+function classStyleExpression(gss_codes, classes, ramp, propname) {
   var expression = ["match", ["get", propname]];
 
-  for (const gss_id in data) {
-    const positivity = data[gss_id].positivity;
-    if (!positivity) {
-      continue;
+  gss_codes.forEach((gss_id, i) => {
+    if (classes[i] == NO_CLASS) {
+      return;
     }
-    var colour = getColour(positivity_colour_ramp, positivity);
+    const colour = ramp[classes[i]][2];
 
     expression.push(gss_id, colour);
     if (gss_id == "E09000012") {
@@ -185,33 +150,56 @@ function positivityStyleExpression(data, propname) {
     } else if (gss_id == "E06000052") {
       expression.push("E06000053", colour);
     }
+  });
+
+  if (expression.length == 2) {
+    // No areas are coloured, which a match expression can't express.
+    return "#ffffff";
   }
   expression.push("#ffffff");
   return expression;
 }
 
-function vaccineStyleExpression(data, propname) {
-  var expression = ["match", ["get", propname]];
+function scaled(value, scale) {
+  return value === null ? null : value / scale;
+}
 
-  for (const gss_id in data) {
-    const pct = data[gss_id].combined_doses;
-    if (!pct) {
-      continue;
+function deltaDecode(deltas, scale) {
+  if (deltas === null) {
+    return null;
+  }
+  let value = 0;
+  return deltas.map((delta) => {
+    if (delta === null) {
+      return null;
     }
-    var colour = getColour(vaccine_colour_ramp, pct);
+    value += delta;
+    return value / scale;
+  });
+}
 
-    expression.push(gss_id, colour);
-    if (gss_id == "E09000012") {
-      expression.push("E09000001", colour);
-    } else if (gss_id == "E06000052") {
-      expression.push("E06000053", colour);
-    }
-  }
-  expression.push("#ffffff");
-  return expression;
+// Turn the columnar payload written by map.py into an object of values for each area.
+function decodeMapData(payload) {
+  const scales = payload.scales;
+  const data = {};
+  payload.gss_code.forEach((gss_id, i) => {
+    data[gss_id] = {
+      cases: payload.cases[i],
+      prevalence: payload.prevalence[i] / scales.prevalence / 100000,
+      change: payload.change[i] / scales.change / 100000,
+      positivity: scaled(payload.positivity[i], scales.positivity),
+      positivity_history: deltaDecode(payload.positivity_history[i], scales.positivity),
+      history: deltaDecode(payload.history[i], 1),
+      provisional_days: payload.provisional_days,
+      first_doses: scaled(payload.first_doses[i], scales.doses),
+      second_doses: scaled(payload.second_doses[i], scales.doses),
+      combined_doses: scaled(payload.combined_doses[i], scales.doses)
+    };
+  });
+  return data;
 }
 
-function popupRenderer(map, data, name_field, gss_field) {
+function popupRenderer(map, data, name_field, gss_field, page_prefix) {
   return function(e) {
     var props = e.features[0].properties;
     let gss = props[gss_field];
@@ -229,6 +217,10 @@ function popupRenderer(map, data, name_field, gss_field) {
       sub_name = "(including Isles of Scilly)";
     }
     let item = data[gss];
+    if (!item) {
+      // The area's region hasn't loaded yet.
+      return;
+    }
 
     let html = "<h3>" + name + "</h3>";
     if (sub_name) {
@@ -272,6 +264,9 @@ function popupRenderer(map, data, name_field, gss_field) {
       html += "<tr><th>Combined</th><td class=\"expand\">" + item['combined_doses'].toFixed(1) + "%</td></tr>";
     }
     html += "</table>";
+    if (page_prefix) {
+      html += '<p><a href="' + page_prefix + gss + '.html">More about ' + name + "</a></p>";
+    }
 
     let div = window.document.createElement("div");
     div.innerHTML = html;
@@ -405,7 +400,187 @@ class SwitchControl {
   }
 }
 
-function initMap(data) {
+const layer_ramps = {
+  cases_abs: colour_ramp,
+  cases_rel: change_colour_ramp,
+  positivity: positivity_colour_ramp,
+  vaccine: vaccine_colour_ramp
+};
+
+// Layers which have history for the time slider. The rest keep their latest colours.
+const history_layers = ["cases_abs", "cases_rel", "positivity"];
+
+// The map's data, which is split by region (see write_map_level in main.py). A region
+// is only loaded once some of its areas are in view, and its history is only loaded
+// for the months being viewed.
+class MapState {
+  constructor(map, index) {
+    this.map = map;
+    this.index = index;
+    // Values for each loaded area, for popups.
+    this.data = {};
+    this._requests = {};
+    this._loaded = [];
+    this._chunks = {};
+    this._day = null;
+    this._renders = 0;
+
+    this._region_of = {};
+    index.regions.forEach((region, i) => {
+      for (const gss_id of region.gss_code) {
+        this._region_of[gss_id] = i;
+      }
+    });
+  }
+
+  visibleRegions() {
+    const regions = new Set();
+    const features = this.map.querySourceFeatures("areas", {
+      sourceLayer: this.index.source_layer
+    });
+    for (const feature of features) {
+      const region = this._region_of[feature.properties[this.index.code_property]];
+      if (region !== undefined) {
+        regions.add(region);
+      }
+    }
+    return regions;
+  }
+
+  loadVisible() {
+    const requests = [];
+    for (const region of this.visibleRegions()) {
+      if (this._requests[region]) {
+        continue;
+      }
+      this._requests[region] = fetch(this.index.regions[region].data)
+        .then((response) => response.json())
+        .then((payload) => {
+          Object.assign(this.data, decodeMapData(payload));
+          this._loaded.push({ region: region, payload: payload });
+        });
+      requests.push(this._requests[region]);
+    }
+
+    if (requests.length) {
+      Promise.all(requests).then(() => this.render());
+    }
+  }
+
+  loadChunk(region, month) {
+    const key = region + "/" + month;
+    if (!this._chunks[key]) {
+      this._chunks[key] = fetch(this.index.regions[region].history[month]).then(
+        (response) => response.json()
+      );
+    }
+    return this._chunks[key];
+  }
+
+  // Show the map on a day of the history, or the latest data if `day` is null.
+  setDay(day) {
+    this._day = day;
+    this.render();
+  }
+
+  render() {
+    const render = ++this._renders;
+    const day = this._day;
+    const loaded = this._loaded.slice();
+
+    const gss_codes = [].concat(...loaded.map((r) => r.payload.gss_code));
+    const classes = {};
+    for (const layer in layer_ramps) {
+      classes[layer] = [].concat(...loaded.map((r) => r.payload.classes[layer]));
+    }
+
+    if (day === null) {
+      this.setClasses(gss_codes, classes);
+      return;
+    }
+
+    const chunks = loaded.map((r) => this.loadChunk(r.region, day.month.month));
+    Promise.all(chunks).then((chunks) => {
+      if (render != this._renders) {
+        return;
+      }
+      // Chunks are (area, day) arrays, flattened in row-major order.
+      const days = day.month.dates.length;
+      for (const layer of history_layers) {
+        classes[layer] = [];
+        chunks.forEach((chunk, j) => {
+          const values = chunk.classes[layer];
+          for (let i = 0; i < loaded[j].payload.gss_code.length; i++) {
+            classes[layer].push(values[i * days + day.day]);
+          }
+        });
+      }
+      this.setClasses(gss_codes, classes);
+    });
+  }
+
+  setClasses(gss_codes, classes) {
+    for (const layer in layer_ramps) {
+      this.map.setPaintProperty(
+        layer,
+        "fill-color",
+        classStyleExpression(
+          gss_codes,
+          classes[layer],
+          layer_ramps[layer],
+          this.index.code_property
+        )
+      );
+    }
+  }
+}
+
+// Slider to show the map on an earlier date.
+class HistoryControl {
+  constructor(state) {
+    this._state = state;
+    this._days = [];
+    for (const month of state.index.months) {
+      month.dates.forEach((date, i) => {
+        this._days.push({ month: month, day: i, date: date });
+      });
+    }
+  }
+
+  onAdd(map) {
+    this._map = map;
+    this._container = document.createElement("div");
+    this._container.className = "mapboxgl-ctrl mapboxgl-ctrl-group history-control";
+
+    this._label = document.createElement("div");
+    this._label.innerText = "Latest";
+
+    this._slider = document.createElement("input");
+    this._slider.type = "range";
+    this._slider.min = 0;
+    // The last position shows the latest data, including provisional days.
+    this._slider.max = this._days.length;
+    this._slider.value = this._days.length;
+    this._slider.oninput = () => this.show(parseInt(this._slider.value));
+
+    this._container.appendChild(this._label);
+    this._container.appendChild(this._slider);
+    return this._container;
+  }
+
+  show(position) {
+    if (position == this._days.length) {
+      this._label.innerText = "Latest";
+      this._state.setDay(null);
+    } else {
+      const day = this._days[position];
+      this._label.innerText = "Week to " + day.date;
+      this._state.setDay(day);
+    }
+  }
+}
+
+function initMap(index_url) {
   if (!mapboxgl.supported()) {
     const map = document.getElementById("body");
     map.innerHTML =
@@ -425,6 +600,9 @@ function initMap(data) {
   });
   window.map = map;
 
+  // Fetch the index while the map loads.
+  const index_request = fetch(index_url).then((response) => response.json());
+
   map.touchZoomRotate.disableRotation();
   map.addControl(new mapboxgl.NavigationControl({ showCompass: false }));
 
@@ -433,7 +611,8 @@ function initMap(data) {
   map.addControl(switchControl, "top-right");
   map.addControl(legend, "bottom-right");
 
-  map.on("load", () => {
+  map.on("load", () => index_request.then((index) => {
+    const state = new MapState(map, index);
     const opacity_func = [
       "interpolate",
       ["exponential", 1.4],
@@ -444,73 +623,36 @@ function initMap(data) {
       0.5
     ];
 
-    map.addLayer(
-      {
-        id: "cases_abs",
-        type: "fill",
-        source: "areas",
-        "source-layer": "local_authorities",
-        paint: {
-          "fill-color": styleExpression(data, "lad19cd"),
-          "fill-opacity": opacity_func
-        }
-      },
-      "la_boundary"
-    );
-
-    map.addLayer(
-      {
-        id: "cases_rel",
-        type: "fill",
-        source: "areas",
-        "source-layer": "local_authorities",
-        paint: {
-          "fill-color": diffStyleExpression(data, "lad19cd"),
-          "fill-opacity": opacity_func
-        },
-        layout: {
-          visibility: "none"
-        }
-      },
-      "la_boundary"
-    );
-
-    map.addLayer(
-      {
-        id: "positivity",
-        type: "fill",
-        source: "areas",
-        "source-layer": "local_authorities",
-        paint: {
-          "fill-color": positivityStyleExpression(data, "lad19cd"),
-          "fill-opacity": opacity_func
+    // Areas are coloured as their regions are loaded.
+    for (const layer in layer_ramps) {
+      map.addLayer(
+        {
+          id: layer,
+          type: "fill",
+          source: "areas",
+          "source-layer": index.source_layer,
+          paint: {
+            "fill-color": "#ffffff",
+            "fill-opacity": opacity_func
+          },
+          layout: {
+            visibility: "none"
+          }
         },
-        layout: {
-          visibility: "none"
-        }
-      },
-      "la_boundary"
-    );
-
-    map.addLayer(
-      {
-        id: "vaccine",
-        type: "fill",
-        source: "areas",
-        "source-layer": "local_authorities",
-        paint: {
-          "fill-color": vaccineStyleExpression(data, "lad19cd"),
-          "fill-opacity": opacity_func
-        },
-        layout: {
-          visibility: "none"
-        }
-      },
-      "la_boundary"
-    );
+        "la_boundary"
+      );
 
-    for (const layer of ["cases_abs", "cases_rel", "positivity", "vaccine"]) {
-      map.on("click", layer, popupRenderer(map, data, "lad19nm", "lad19cd"));
+      map.on(
+        "click",
+        layer,
+        popupRenderer(
+          map,
+          state.data,
+          index.name_property,
+          index.code_property,
+          index.page_prefix
+        )
+      );
 
       map.on("mouseenter", layer, function() {
         map.getCanvas().style.cursor = "pointer";
@@ -521,11 +663,17 @@ function initMap(data) {
       });
     }
 
-    let state = window.location.hash.split("#")[1];
-    if (state) {
-      switchControl.setState(state);
+    let state_id = window.location.hash.split("#")[1];
+    if (state_id) {
+      switchControl.setState(state_id);
     } else {
       switchControl.setState("cases_abs");
     }
-  });
+
+    // Tiles for the current view have loaded once the map is idle.
+    map.on("idle", () => state.loadVisible());
+    state.loadVisible();
+
+    map.addControl(new HistoryControl(state), "bottom-left");
+  }));
 }
@@ -0,0 +1,115 @@
+""" Pango lineage ancestry.
+
+    Lineage parents are derived from the pango-designation alias key, which is fetched
+    through the download cache the first time it's needed rather than on import.
+
+    Further info on the lineage naming rules here:
+    https://virological.org/t/pango-lineage-nomenclature-provisional-rules-for-naming-recombinant-lineages/657
+"""
+import json
+from download import fetch
+
+ALIAS_KEY_URL = (
+    "https://raw.githubusercontent.com/cov-lineages/pango-designation"
+    "/master/pango_designation/alias_key.json"
+)
+
+
+class LineageIndex:
+    """ Parent and ancestor lookups for pango lineages. Results are memoised, so
+        repeated queries for the same lineage are dictionary lookups.
+    """
+
+    def __init__(self, aliases):
+        self.aliases = aliases
+        self._parents = {}
+        self._ancestors = {}
+
+        # Precompute the chains for the aliased roots, which every lineage under an
+        # alias shares.
+        for alias in aliases:
+            self.ancestors(alias)
+
+    def parent(self, lineage):
+        """ The parent of `lineage`, or `lineage` itself if it is a root lineage. """
+        try:
+            return self._parents[lineage]
+        except KeyError:
+            parent = self._parents[lineage] = self._find_parent(lineage)
+            return parent
+
+    def _find_parent(self, lineage):
+        lineage_parts = lineage.split(".")
+
+        if len(lineage_parts) >= 3:
+            return ".".join(lineage_parts[:-1])
+
+        # We're either one step up from the root of a lineage, or we are at the root
+        # of the lineage.
+        root = lineage_parts[0]
+        parent = self.aliases.get(root)
+
+        if not parent:
+            # Parent lineage either doesn't exist in the alias key, or is one of the
+            # root lineages (A or B)
+            return root
+
+        if isinstance(parent, list):
+            # This happens if the lineage is a recombination of two parents
+            # Pick the one with the longest lineage chain to be the parent,
+            # ie. the most dots in the lineage name. Does not handle ties as is.
+            return max(parent, key=lambda x: len(x.split(".")))
+
+        return parent
+
+    def ancestors(self, lineage):
+        """ The chain of ancestors of `lineage`, nearest first, ending at its root. """
+        try:
+            return self._ancestors[lineage]
+        except KeyError:
+            pass
+
+        parent = self.parent(lineage)
+        if parent == lineage:
+            chain = ()
+        else:
+            chain = (parent,) + self.ancestors(parent)
+        self._ancestors[lineage] = chain
+        return chain
+
+
+class PrefixTrie:
+    """ Map strings to the value of the shortest key which they start with. """
+
+    def __init__(self, mapping={}):
+        self.root = {}
+        for key, value in mapping.items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def match(self, string, default=None):
+        node = self.root
+        for char in string:
+            if None in node:
+                return node[None]
+            node = node.get(char)
+            if node is None:
+                return default
+        return node.get(None, default)
+
+
+_lineage_index = None
+
+
+def lineage_index():
+    """ The shared LineageIndex, loaded on first use. """
+    global _lineage_index
+    if _lineage_index is None:
+        with open(fetch(ALIAS_KEY_URL)) as f:
+            _lineage_index = LineageIndex(json.load(f))
+    return _lineage_index
@@ -0,0 +1,137 @@
+""" Dependency-graph scheduler for the site build.
+
+    The build is declared as a list of `Task`s, each naming the tasks whose results it
+    takes as arguments. Tasks run in a process pool as soon as their dependencies are
+    available, so independent pages are built concurrently. Tasks marked `io` (data
+    fetches) run in a thread pool in the scheduling process instead, so that all
+    network requests can be in flight at once without each holding a process.
+"""
+import time
+import logging
+import multiprocessing
+from collections import Counter, namedtuple
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    FIRST_COMPLETED,
+    wait,
+)
+
+log = logging.getLogger(__name__)
+
+Task = namedtuple(
+    "Task", ["name", "func", "deps", "io", "timeout"], defaults=[False, None]
+)
+
+
+class BuildError(Exception):
+    pass
+
+
+def _call(func, args, caches):
+    start = time.monotonic()
+    result = func(*args)
+    counts = {name: take_counts() for name, take_counts in caches.items()}
+    return result, time.monotonic() - start, counts
+
+
+def run(tasks, processes=None, threads=8, caches={}):
+    """ Run `tasks`, returning a dict of results by task name.
+
+        Each task's function is called with the results of its `deps`, in order.
+        If a task raises, or runs for longer than its `timeout` in seconds, tasks
+        which depend on it are skipped, the rest of the graph carries on, and a
+        BuildError is raised once everything has finished.
+
+        At most `processes` CPU tasks and `threads` I/O tasks run at once.
+
+        `caches` maps the names of per-process caches which tasks use to functions
+        taking their hits and misses since last called. These are collected after
+        each task and the hit rate of each cache is logged at the end of the build.
+    """
+    pending = {task.name: task for task in tasks}
+    for task in pending.values():
+        for dep in task.deps:
+            if dep not in pending:
+                raise ValueError(f"Task {task.name} depends on unknown task {dep}")
+
+    results = {}
+    cache_counts = {name: Counter() for name in caches}
+    failed = set()
+    running = {}
+    deadlines = {}
+    start = time.monotonic()
+
+    io_pool = ThreadPoolExecutor(threads)
+    # Workers are started from a fork server, rather than forked from this process
+    # while its I/O threads may be holding locks, such as those of logging handlers.
+    context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(processes, mp_context=context) as pool:
+        while pending or running:
+            progress = True
+            while progress:
+                progress = False
+                for name, task in list(pending.items()):
+                    if any(dep in failed for dep in task.deps):
+                        log.error("Skipping %s as a dependency failed", name)
+                        failed.add(name)
+                    elif all(dep in results for dep in task.deps):
+                        args = [results[dep] for dep in task.deps]
+                        executor = io_pool if task.io else pool
+                        future = executor.submit(_call, task.func, args, caches)
+                        running[future] = name
+                        if task.timeout:
+                            deadlines[future] = time.monotonic() + task.timeout
+                    else:
+                        continue
+                    del pending[name]
+                    progress = True
+
+            if not running:
+                if pending:
+                    raise ValueError(
+                        "Dependency cycle between tasks: " + ", ".join(sorted(pending))
+                    )
+                break
+
+            timeout = None
+            if deadlines:
+                timeout = max(0, min(deadlines.values()) - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future, deadline in list(deadlines.items()):
+                if future not in done and time.monotonic() >= deadline:
+                    name = running.pop(future)
+                    del deadlines[future]
+                    future.cancel()
+                    log.error("Task %s timed out", name)
+                    failed.add(name)
+
+            for future in done:
+                name = running.pop(future)
+                deadlines.pop(future, None)
+                try:
+                    results[name], elapsed, counts = future.result()
+                except Exception:
+                    log.exception("Task %s failed", name)
+                    failed.add(name)
+                else:
+                    log.info("Finished %s in %.1fs", name, elapsed)
+                    for cache, cache_count in counts.items():
+                        cache_counts[cache].update(cache_count)
+
+    # Don't wait for any timed-out fetches which are still running.
+    io_pool.shutdown(wait=False)
+    log.info("Build finished in %.1fs", time.monotonic() - start)
+    for cache, counts in cache_counts.items():
+        lookups = counts["hits"] + counts["misses"]
+        log.info(
+            "Cache %s: %d hits, %d misses (%.0f%% hit rate)",
+            cache,
+            counts["hits"],
+            counts["misses"],
+            counts["hits"] / lookups * 100 if lookups else 0,
+        )
+    if failed:
+        raise BuildError("Failed tasks: " + ", ".join(sorted(failed)))
+    return results
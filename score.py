@@ -1,57 +1,106 @@
+import numpy as np
 import pandas as pd
+from derived import series
+from map import latest_weekly
 
 PROVISIONAL_DAYS = 5
 
+# Number of trailing days which are searched for the latest complete change.
+WINDOW_DAYS = 14
 
-def calculate_score(cases, triage_online, triage_pathways, admissions):
-    cases_change = (
-        cases["cases_rolling"][:, :-PROVISIONAL_DAYS]
-        / cases["cases_rolling"][:, :-PROVISIONAL_DAYS].shift(date=7)
-    ).dropna("date") - 1
-    online_change = (
-        (
-            triage_online["count_rolling_7"]
-            / triage_online["count_rolling_7"].shift(date=7)
-        ).dropna("date")
-        - 1
-        if triage_online
-        else None
-    )
-    pathways_change = (
-        (
-            triage_pathways["count_rolling_7"]
-            / triage_pathways["count_rolling_7"].shift(date=7)
-        ).dropna("date")
-        - 1
-        if triage_pathways
-        else None
+# Areas with fewer weekly cases than this aren't ranked, as their changes are noisy.
+MIN_WEEKLY_CASES = 50
+
+METRICS = ["triage_online", "triage_pathways", "cases", "admissions"]
+
+
+def latest_change(series, dim="location", skip_days=0, window=WINDOW_DAYS):
+    """ Latest week-on-week change in `series`, a rolling average by `dim` and date,
+        as a fraction, ignoring the last `skip_days`.
+
+        Only the trailing `window` days (and the week before them) are used, and the
+        change is taken on the latest of those days on which every location has a
+        value. Returns the changes, as a series by location, and their date.
+    """
+    values = series.transpose(dim, "date").values
+    end = values.shape[1] - skip_days
+    start = max(end - window - 7, 0)
+    values = values[:, start:end]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = values[:, 7:] / values[:, :-7] - 1
+
+    complete = np.flatnonzero(~np.isnan(change).any(axis=0))
+    if not len(complete):
+        raise ValueError(f"No complete week-on-week change in the last {window} days")
+    day = complete[-1]
+    return (
+        pd.Series(change[:, day], index=series[dim].values),
+        pd.Timestamp(series["date"].values[start + 7 + day]),
     )
-    admissions_change = (
-        admissions["admissions_rolling"]
-        / admissions["admissions_rolling"].shift(date=7)
-    ).dropna("date") - 1
-
-    data = {"scores": {}}
-    for loc in [loc.item() for loc in cases_change["location"]]:
-        data["scores"][loc] = {
-            "cases": cases_change[:, -1].sel(location=loc).item() * 100,
-            "triage_online": online_change[:, -1].sel(region=loc).item() * 100
-            if triage_online
-            else None,
-            "triage_pathways": pathways_change[:, -1].sel(region=loc).item() * 100
-            if triage_pathways
-            else None,
-            "admissions": admissions_change[:, -1].sel(location=loc).item() * 100,
-        }
-
-    data["dates"] = {
-        "cases": pd.to_datetime(cases_change[:, -1]["date"].data),
-        "triage_online": pd.to_datetime(online_change[:, -1]["date"].data)
-        if triage_online
-        else None,
-        "triage_pathways": pd.to_datetime(pathways_change[:, -1]["date"].data)
-        if triage_pathways
-        else None,
-        "admissions": pd.to_datetime(admissions_change[:, -1]["date"].data),
+
+
+def calculate_score(cases, triage_online, triage_pathways, admissions):
+    metrics = {
+        "cases": (cases["net_cases_rolling_7"], "location", PROVISIONAL_DAYS),
+        "admissions": (admissions["admissions_rolling"], "location", 0),
+    }
+    if triage_online:
+        metrics["triage_online"] = (triage_online["count_rolling_7"], "region", 0)
+    if triage_pathways:
+        metrics["triage_pathways"] = (triage_pathways["count_rolling_7"], "region", 0)
+
+    changes = {}
+    dates = dict.fromkeys(METRICS)
+    for name, (series, dim, skip_days) in metrics.items():
+        changes[name], dates[name] = latest_change(series, dim, skip_days)
+
+    scores = pd.DataFrame(changes).reindex(changes["cases"].index) * 100
+    scores = scores.astype(object).where(scores.notnull(), None)
+    return {
+        "scores": {
+            location: {name: row.get(name) for name in METRICS}
+            for location, row in scores.to_dict("index").items()
+        },
+        "dates": dates,
+    }
+
+
+def rising_areas(eng_by_gss, names, count=20):
+    """ The `count` local authorities whose cases are rising fastest, with their
+        `names`, weekly cases per 100,000 and week-on-week change as a percentage.
+    """
+    cases = series(eng_by_gss, "weekly_cases").transpose("gss_code", "date").values
+    rates = series(eng_by_gss, "weekly_cases_per_100k")
+    rates = rates.transpose("gss_code", "date").values
+
+    # Every area is compared on the latest week which doesn't include the provisional
+    # days. Areas with no change on it, such as those with no recent cases, aren't
+    # eligible.
+    day = -PROVISIONAL_DAYS - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = cases[:, day] / cases[:, day - 7] - 1
+    date = pd.Timestamp(eng_by_gss["date"].values[day])
+    weekly_cases = cases[:, day]
+    # Rates are shown as they are on the map.
+    weekly_rate = latest_weekly(rates, PROVISIONAL_DAYS)
+
+    eligible = np.flatnonzero(np.isfinite(change) & (weekly_cases >= MIN_WEEKLY_CASES))
+    count = min(count, len(eligible))
+    top = eligible[:0]
+    if count:
+        top = eligible[np.argpartition(-change[eligible], count - 1)[:count]]
+        top = top[np.argsort(-change[top])]
+
+    gss_codes = eng_by_gss["gss_code"].values
+    return {
+        "date": date,
+        "areas": [
+            {
+                "gss_code": gss_codes[i],
+                "name": names[i],
+                "weekly_rate": weekly_rate[i],
+                "change": change[i] * 100,
+            }
+            for i in top
+        ],
     }
-    return data
@@ -1,5 +1,7 @@
 from jinja2 import Environment, FileSystemLoader, select_autoescape
+import os
 import json
+import hashlib
 from datetime import datetime
 from bokeh.embed import json_item
 from bokeh.themes import Theme
@@ -11,15 +13,41 @@ env = Environment(
 theme = Theme("./theme.yaml")
 
 
-def render_template(name, graphs={}, **kwargs):
+def graph_items(graphs):
+    """ Serialise a dict of Bokeh figures by element ID for embedding in a page. """
+    return [
+        json_item(graph, name, theme=theme)
+        for name, graph in graphs.items()
+        if graph is not None
+    ]
+
+
+def render_template(name, graphs={}, items=(), template=None, **kwargs):
+    """ Render a template to `name` in the output directory, embedding `graphs` and
+        any `items` already serialised with graph_items. The template defaults to the
+        one called `name`.
+    """
     print(f"Rendering {name}...")
 
-    graphs_data = json.dumps(
-        [json_item(graph, name, theme=theme) for name, graph in graphs.items() if graph is not None]
-    )
+    graphs_data = json.dumps(graph_items(graphs) + list(items))
 
     generated = datetime.now()
 
-    template = env.get_template(name)
-    with open(f"output/{name}", "w") as f:
+    template = env.get_template(template or name)
+    path = f"output/{name}"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
         f.write(template.render(graphs=graphs_data, generated=generated, **kwargs))
+
+
+def write_data(name, data):
+    """ Write `data` as JSON to a separate file alongside the pages, returning a URL
+        for it which changes with its content, so that it can be cached.
+    """
+    content = json.dumps(data, separators=(",", ":"), allow_nan=False)
+    path = f"output/{name}"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    return f"{name}?v={digest}"